@@ -4,14 +4,36 @@ Flask web app for Notion for DS
 """
 
 import os
-import json
 import sys
-import webbrowser
+
+import startup
+
+if __name__ == '__main__':
+    # Claim the port (and open the browser) before loading Flask and the Notion client;
+    # the browser's request waits in the listen backlog until the server is up
+    startup.listen(int(os.environ.get('PORT', 5001)), open_browser=not getattr(sys, 'frozen', False))
+
+import io
+import uuid
+import json
+import logging
 import threading
 import time
-from flask import Flask, render_template, request, jsonify, redirect, url_for
-from dotenv import load_dotenv
-from notion_client import Client
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, stream_with_context
+from dotenv import load_dotenv, dotenv_values
+from app_context import AppContext
+from batch import iter_scans, page_properties, run_batch
+from circuit_breaker import STATE_VALUES
+from events import EventBroker, stream_events
+from guide_index import GuideIndex, extract_route
+from idempotency import IdempotencyCache
+from log_setup import configure_logging
+import metrics
+from metrics import SCANS, SCAN_SECONDS, span
+from notion_scheduler import PRIORITY_HIGH, request_priority
+from scan_queue import ScanQueue
+from station_state import create_station_store
+from tenants import ENVIRON_KEY, TenantPrefixMiddleware, TenantRegistry, current_tenant, use_tenant
 
 # Handle PyInstaller bundled environment
 if getattr(sys, 'frozen', False):
@@ -22,8 +44,19 @@ else:
     # Running in normal Python environment
     app = Flask(__name__)
 
-# Global variable to track the last entry ID
-last_entry_id = None
+logger = logging.getLogger('notionfords')
+
+# Last entry created by each scanner station (see get_station_store)
+station_store = None
+station_store_lock = threading.Lock()
+
+# Responses to recent scans, so repeats don't reach Notion (see get_idempotency_cache)
+idempotency_cache = None
+idempotency_cache_lock = threading.Lock()
+
+# Live feed of scans and Notion writes for /events watchers (see get_event_broker)
+event_broker = None
+event_broker_lock = threading.Lock()
 
 def load_environment():
     """Load environment variables from .env file"""
@@ -43,9 +76,39 @@ def load_environment():
     
     return notion_token, database_id, guide_database_id, message_property, name_property, barcode_properties, mastercode_property, route_property
 
+# Cached configuration and shared Notion client, reloaded when .env changes
+context = AppContext(load_environment)
+
+# Warehouses served by this process, .env being the default one (see tenants.py).
+# Each has its own Notion client, schema cache, Guide index and write-behind queue.
+tenants = TenantRegistry(context)
+app.wsgi_app = TenantPrefixMiddleware(app.wsgi_app, tenants)
+
+def tenant_context():
+    """Context of the tenant whose scan is being handled (the .env one otherwise)"""
+    return current_tenant(tenants.default).context
+
+def get_tenant(station=None):
+    """Tenant of the current request: from its URL prefix, else from its station"""
+    name = request.environ.get(ENVIRON_KEY)
+    if name:
+        return tenants.get(name)
+    return tenants.for_station(station) if station else tenants.default
+
 def update_env_file(token, database_id, guide_database_id="", message_property="Message", name_property="Name", barcode_properties="barcode,Barcode,BARCODE", mastercode_property="Mastercode", route_property="Route"):
     """Update the .env file with new credentials"""
     try:
+        managed_keys = {
+            'NOTION_TOKEN', 'NOTION_DATABASE_ID', 'NOTION_GUIDE_DATABASE_ID',
+            'NOTION_MESSAGE_PROPERTY', 'NOTION_NAME_PROPERTY', 'NOTION_BARCODE_PROPERTIES',
+            'NOTION_MASTERCODE_PROPERTY', 'NOTION_ROUTE_PROPERTY'
+        }
+        # Keep settings the admin panel doesn't manage (queue, guide index, ...)
+        other_settings = {
+            key: value for key, value in dotenv_values('.env').items()
+            if key not in managed_keys and value is not None
+        } if os.path.exists('.env') else {}
+        
         env_content = f"""# Notion API Configuration
 NOTION_TOKEN={token}
 NOTION_DATABASE_ID={database_id}
@@ -61,6 +124,9 @@ NOTION_BARCODE_PROPERTIES={barcode_properties}
 NOTION_MASTERCODE_PROPERTY={mastercode_property}
 NOTION_ROUTE_PROPERTY={route_property}
 """
+        if other_settings:
+            env_content += "\n# Other Settings\n" + "".join(f"{key}={value}\n" for key, value in other_settings.items())
+        
         with open('.env', 'w') as f:
             f.write(env_content)
         return True, "Environment variables updated successfully"
@@ -97,80 +163,133 @@ def check_guide_database(client, guide_database_id, mastercode, mastercode_prope
         
         if response['results']:
             # Found a match, get the route
-            page = response['results'][0]
-            route_property_data = page['properties'].get(route_property, {})
-            
-            if route_property_data.get('type') == 'rich_text' and route_property_data['rich_text']:
-                return True, route_property_data['rich_text'][0]['text']['content']
-            elif route_property_data.get('type') == 'title' and route_property_data['title']:
-                return True, route_property_data['title'][0]['text']['content']
-            else:
-                return True, "Route not found"
+            return True, extract_route(response['results'][0], route_property)
         else:
             return False, None
             
     except Exception as e:
         return False, f"Error checking Guide database: {str(e)}"
 
+def get_guide_index(notion_token, guide_database_id, mastercode_property='Mastercode', route_property='Route'):
+    """Return the current tenant's Guide index, (re)starting it if its configuration changed"""
+    tenant = current_tenant(tenants.default)
+    
+    # Prefix, range and regex rules are read from these Guide properties (see mastercode_rules.py)
+    match_property = os.getenv('NOTION_MATCH_PROPERTY', 'Match')
+    check_digit_property = os.getenv('NOTION_CHECK_DIGIT_PROPERTY', 'Check Digit')
+    config = (notion_token, guide_database_id, mastercode_property, route_property, match_property, check_digit_property)
+    with tenant.guide_index_lock:
+        if tenant.guide_index is None or tenant.guide_index_config != config:
+            if tenant.guide_index is not None:
+                tenant.guide_index.stop()
+            tenant.guide_index = GuideIndex(
+                tenant.context.client(),
+                guide_database_id,
+                mastercode_property,
+                route_property,
+                refresh_interval=float(os.getenv('NOTION_GUIDE_REFRESH_SECONDS', '60')),
+                cache_path=tenant.path(os.getenv('NOTION_GUIDE_CACHE_PATH', 'guide_cache.json')) or None,
+                match_property=match_property,
+                check_digit_property=check_digit_property
+            )
+            tenant.guide_index_config = config
+            tenant.guide_index.start()
+        return tenant.guide_index
+
+def lookup_mastercode(client, notion_token, guide_database_id, mastercode, mastercode_property='Mastercode', route_property='Route'):
+    """Resolve a mastercode from the local Guide index, querying Notion only when the index can't answer"""
+    index = get_guide_index(notion_token, guide_database_id, mastercode_property, route_property)
+    if index.ready:
+        is_mastercode, route_value = index.lookup(mastercode)
+        fallback = os.getenv('NOTION_GUIDE_FALLBACK_QUERY', 'false').lower() in ('1', 'true', 'yes')
+        if is_mastercode or not fallback:
+            return is_mastercode, route_value
+    
+    # Index still building (or fallback enabled for misses): ask Notion directly
+    return check_guide_database(client, guide_database_id, mastercode, mastercode_property, route_property)
+
 def update_previous_entry(client, database_id, page_id, barcode_value, barcode_properties=['barcode', 'Barcode', 'BARCODE']):
     """Update the barcode field of a previous entry"""
     try:
-        # First, let's get the current page to see the exact property structure
-        current_page = client.pages.retrieve(page_id)
-        properties = current_page.get('properties', {})
-        
-        print(f"🔍 Current page properties: {list(properties.keys())}")
-        
-        # Try different property name variations
-        barcode_prop_name = None
-        for prop_name in barcode_properties:
-            if prop_name in properties:
-                barcode_prop_name = prop_name
-                break
-        
-        if not barcode_prop_name:
-            return False, "Barcode property not found"
-        
-        print(f"🔍 Using barcode property: {barcode_prop_name}")
-        
-        # Update the barcode field
-        client.pages.update(
-            page_id=page_id,
-            properties={
-                barcode_prop_name: {
-                    "select": {
-                        "name": barcode_value
+        # Route updates jump ahead of new entries waiting for the rate limiter
+        with request_priority(PRIORITY_HIGH), span('update'):
+            # Resolve the barcode property from the cached database schema
+            properties = tenant_context().schema_cache.properties(client, database_id)
+            if properties is None:
+                # Schema unavailable, read the page itself to see its property structure
+                properties = client.pages.retrieve(page_id).get('properties', {})
+            
+            # Try different property name variations
+            barcode_prop_name = None
+            for prop_name in barcode_properties:
+                if prop_name in properties:
+                    barcode_prop_name = prop_name
+                    break
+            
+            if not barcode_prop_name:
+                return False, "Barcode property not found"
+            
+            logger.debug("Updating barcode", extra={'page_id': page_id, 'property': barcode_prop_name, 'route': barcode_value})
+            
+            # Update the barcode field
+            client.pages.update(
+                page_id=page_id,
+                properties={
+                    barcode_prop_name: {
+                        "select": {
+                            "name": barcode_value
+                        }
                     }
                 }
-            }
-        )
+            )
         return True, "Barcode updated successfully"
     except Exception as e:
+        # The schema may be stale (e.g. a renamed property), fetch it again next time
+        tenant_context().schema_cache.invalidate(database_id)
         return False, f"Error updating barcode: {str(e)}"
 
-def get_last_entry_id(client, database_id):
-    """Get the ID of the most recent entry in the database"""
-    try:
-        response = client.databases.query(
-            database_id=database_id,
-            sorts=[{
-                "property": "created time",
-                "direction": "descending"
-            }],
-            page_size=1
-        )
-        
-        if response['results']:
-            return response['results'][0]['id']
-        else:
-            return None
-            
-    except Exception as e:
-        print(f"❌ Error getting last entry: {e}")
+def resolve_barcode_property(client, database_id, barcode_properties):
+    """Return the barcode property of a database from its cached schema, or None"""
+    properties = tenant_context().schema_cache.properties(client, database_id) or {}
+    return next((name for name in barcode_properties if name in properties), None)
+
+def resolve_scan_id_property(client, database_id):
+    """Return the property scan IDs are written to (NOTION_SCAN_ID_PROPERTY) if the database has it, or None"""
+    scan_id_property = os.getenv('NOTION_SCAN_ID_PROPERTY')
+    if not scan_id_property:
         return None
+    properties = tenant_context().schema_cache.properties(client, database_id) or {}
+    return scan_id_property if properties.get(scan_id_property, {}).get('type') == 'rich_text' else None
 
-def store_in_notion_database(client, database_id, message, guide_database_id=None, message_property='Message', name_property='Name'):
-    """Store a message in the specified Notion database"""
+def find_scanned_entry(client, database_id, scan_id):
+    """Return the entry already created for a scan ID, or None"""
+    scan_id_property = resolve_scan_id_property(client, database_id) if scan_id else None
+    if not scan_id_property:
+        return None
+    response = client.databases.query(
+        database_id=database_id,
+        filter={"property": scan_id_property, "rich_text": {"equals": scan_id}},
+        page_size=1
+    )
+    return response['results'][0]['id'] if response['results'] else None
+
+def store_in_notion_database(client, database_id, message, guide_database_id=None, message_property='Message', name_property='Name', barcode_property=None, barcode_value=None, scan_id=None):
+    """Store a message in the specified Notion database, optionally with its barcode and scan ID already set"""
+    # Pick the title property from the cached schema so only one create call is needed
+    title_property = tenant_context().schema_cache.title_property(client, database_id, [message_property, name_property])
+    if title_property:
+        scan_id_property = resolve_scan_id_property(client, database_id) if scan_id else None
+        try:
+            response = client.pages.create(
+                parent={"database_id": database_id},
+                properties=page_properties(title_property, message, barcode_property, barcode_value, scan_id_property, scan_id)
+            )
+            return True, response['id']
+        except Exception as e:
+            tenant_context().schema_cache.invalidate(database_id)
+            return False, str(e)
+    
+    # Schema unavailable, probe with the Message property first
     try:
         # First try to create with Message as title property
         response = client.pages.create(
@@ -213,9 +332,216 @@ def store_in_notion_database(client, database_id, message, guide_database_id=Non
         else:
             return False, str(e)
 
+def get_station_store():
+    """Return the per-station state store, creating the configured backend on first use"""
+    global station_store
+    
+    with station_store_lock:
+        if station_store is None:
+            station_store = create_station_store(
+                os.getenv('NOTION_STATION_BACKEND', 'memory'),
+                os.getenv('NOTION_STATION_PATH', 'stations.db')
+            )
+        return station_store
+
+def get_station_id(data):
+    """Identify the scanner station a request came from"""
+    return str(data.get('station') or request.headers.get('X-Station-Id') or request.remote_addr or 'default')
+
+def write_behind_enabled():
+    """Whether /store should queue scans instead of waiting for Notion"""
+    return os.getenv('NOTION_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+
+def offline_mode_enabled():
+    """Whether scans are kept in the local journal while Notion is unreachable"""
+    return os.getenv('NOTION_OFFLINE_MODE', 'false').lower() in ('1', 'true', 'yes')
+
+def should_queue_offline(station):
+    """Whether a scan from this station must go through the journal instead of straight to Notion.
+
+    That is while Notion is unreachable, and also while the station still has
+    scans waiting in the journal, so its scans reach Notion in scan order.
+    """
+    if not offline_mode_enabled():
+        return False
+    return not tenant_context().scheduler.online or get_scan_queue().has_pending(station)
+
+def notion_unreachable():
+    """Whether a failed write should be journalled for replay instead of reported"""
+    return offline_mode_enabled() and not tenant_context().scheduler.online
+
+def queue_offline(message, station, route=None, scan_id=None, attempts=0):
+    """Journal a scan to be replayed when Notion is reachable, returning its queue ID"""
+    queue_id = get_scan_queue().enqueue(message, station, route, get_station_store().get_last_entry(station), scan_id, attempts)
+    logger.info("Scan saved offline", extra={'queue_id': queue_id, 'station': station})
+    return queue_id
+
+def offline_response(queue_id, is_mastercode):
+    """/store response for a scan kept in the journal"""
+    return jsonify({
+        'success': True,
+        'message': 'Scan saved, it will be sent to Notion when the connection is back',
+        'scan_id': queue_id,
+        'queued': True,
+        'offline': not tenant_context().scheduler.online,
+        'is_mastercode': is_mastercode
+    })
+
+def get_idempotency_cache():
+    """Return the cache of recent /store responses, creating it on first use"""
+    global idempotency_cache
+    
+    with idempotency_cache_lock:
+        if idempotency_cache is None:
+            idempotency_cache = IdempotencyCache(
+                max_entries=int(os.getenv('NOTION_IDEMPOTENCY_CACHE_SIZE', '10000')),
+                ttl=float(os.getenv('NOTION_IDEMPOTENCY_TTL_SECONDS', '600')),
+                path=os.getenv('NOTION_IDEMPOTENCY_PATH') or None
+            )
+        return idempotency_cache
+
+def idempotency_keys(data, station):
+    """Return (key, previous key, max age) identifying repeats of this scan, or Nones.
+
+    A key sent by the client (``idempotency_key`` or the Idempotency-Key
+    header) is remembered for the cache TTL. Otherwise the same code from the
+    same station within NOTION_DEBOUNCE_MS counts as a scanner double-fire:
+    the key is (station, code, time bucket), and the previous bucket's key
+    catches a double-fire that straddles two buckets.
+    """
+    client_key = data.get('idempotency_key') or request.headers.get('Idempotency-Key')
+    if client_key:
+        return f"key:{station}:{client_key}", None, None
+    
+    window = float(os.getenv('NOTION_DEBOUNCE_MS', '500')) / 1000
+    message = data.get('message')
+    if window <= 0 or not message:
+        return None, None, None
+    bucket = int(time.time() / window)
+    return f"scan:{station}:{message}:{bucket}", f"scan:{station}:{message}:{bucket - 1}", window
+
+def get_event_broker():
+    """Return the live event feed, creating it on first use"""
+    global event_broker
+
+    with event_broker_lock:
+        if event_broker is None:
+            # Every watcher holds a server thread, leave most of them for scans
+            threads = int(os.getenv('NOTION_SERVER_THREADS', '8'))
+            event_broker = EventBroker(
+                max_subscribers=int(os.getenv('NOTION_EVENTS_MAX_WATCHERS') or max(1, threads // 4)),
+                max_buffer=int(os.getenv('NOTION_EVENTS_BUFFER', '100'))
+            )
+        return event_broker
+
+def publish_event(event_type, station, **data):
+    """Tell live feed watchers what just happened to a scan of the current tenant"""
+    get_event_broker().publish(event_type, current_tenant(tenants.default).name, station=station, **data)
+
+def get_scan_queue(tenant=None):
+    """Return a tenant's write-behind queue, opening its journal and starting its workers on first use.
+    
+    Each tenant has its own journal and workers, so one site's backlog or
+    outage never holds up another's scans.
+    """
+    tenant = tenant or current_tenant(tenants.default)
+    
+    def process(scan):
+        with use_tenant(tenant):
+            return process_queued_scan(scan)
+    
+    with tenant.scan_queue_lock:
+        if tenant.scan_queue is None:
+            tenant.scan_queue = ScanQueue(
+                tenant.path(os.getenv('NOTION_QUEUE_PATH', 'scan_queue.db')),
+                process,
+                workers=int(os.getenv('NOTION_QUEUE_WORKERS', '2')),
+                hold_window=float(os.getenv('NOTION_COALESCE_WINDOW_MS', '0')) / 1000,
+                is_offline=lambda: not tenant.context.scheduler.online,
+                offline_retry=float(os.getenv('NOTION_OFFLINE_RETRY_SECONDS', '15'))
+            ).start()
+        return tenant.scan_queue
+
+def process_queued_scan(scan):
+    """Write one queued scan to the current tenant's Notion database, returning (success, page_id or error)"""
+    notion_token, database_id, guide_database_id, message_property, name_property, barcode_properties, mastercode_property, route_property = tenant_context().config()
+    
+    if not notion_token or not database_id:
+        return False, 'Notion credentials not configured'
+    
+    notion = tenant_context().client()
+    message = scan['message']
+    
+    if scan['action'] == 'update':
+        # The station's last entry when this mastercode was scanned, or the page written for the
+        # queued entry it targets; None if there was no entry then (or the targeted one failed)
+        entry_to_update = scan.get('target_page_id')
+        
+        if entry_to_update:
+            success, result = attach_route(notion, scan['station'], entry_to_update, scan['route'])
+            return success, entry_to_update if success else result
+        
+        # No previous entry to attach to, create a new entry with the route as the message
+        message, route = scan['route'], None
+    else:
+        # A mastercode queued right behind this entry has been merged into its create
+        route = scan.get('route')
+    
+    if scan['sent']:
+        # An earlier attempt may have reached Notion before failing, don't create the entry twice
+        page_id = find_scanned_entry(notion, database_id, scan.get('uid'))
+        if page_id:
+            logger.info("Queued scan was already stored", extra={'queue_id': scan['id'], 'page_id': page_id})
+            get_station_store().set_last_entry(scan['station'], page_id)
+            publish_event('write_confirmed', scan['station'], message=message, page_id=page_id)
+            if route is not None:
+                success, result = attach_route(notion, scan['station'], page_id, route)
+                if not success:
+                    return False, result
+            return True, page_id
+    
+    return create_entry(notion, scan['station'], message, route, scan.get('uid'))
+
+def create_entry(notion, station, message, route=None, scan_id=None):
+    """Create a station's new entry with its route set in the same call when possible"""
+    notion_token, database_id, guide_database_id, message_property, name_property, barcode_properties, mastercode_property, route_property = tenant_context().config()
+    
+    barcode_property = resolve_barcode_property(notion, database_id, barcode_properties) if route is not None else None
+    with span('create'):
+        success, result = store_in_notion_database(notion, database_id, message, guide_database_id, message_property, name_property, barcode_property, route, scan_id)
+    if not success:
+        publish_event('write_failed', station, message=message, error=result)
+        return False, result
+    
+    get_station_store().set_last_entry(station, result)
+    publish_event('write_confirmed', station, message=message, page_id=result)
+    if route is not None:
+        if not barcode_property:
+            # Schema unavailable, fall back to a separate update of the new entry
+            route_success, route_result = attach_route(notion, station, result, route)
+            if not route_success:
+                return False, route_result
+        else:
+            publish_event('route_attached', station, page_id=result, route=route)
+    return True, result
+
+def attach_route(notion, station, page_id, route):
+    """Set a mastercode's route on an entry of the station, telling live feed watchers the outcome"""
+    notion_token, database_id, guide_database_id, message_property, name_property, barcode_properties, mastercode_property, route_property = tenant_context().config()
+    
+    success, result = update_previous_entry(notion, database_id, page_id, route, barcode_properties)
+    if success:
+        publish_event('route_attached', station, page_id=page_id, route=route)
+    else:
+        publish_event('write_failed', station, page_id=page_id, route=route, error=result)
+    return success, result
+
 @app.route('/')
 def index():
     """Home page"""
+    elapsed = startup.mark('first_page_ms')
+    if elapsed is not None:
+        logger.info("Time to interactive", extra=startup.timings())
     try:
         return render_template('index.html')
     except Exception as e:
@@ -265,10 +591,15 @@ def update_credentials():
         if not token or not database_id:
             return jsonify({'success': False, 'error': 'Both token and database ID are required'})
         
+        if request.environ.get(ENVIRON_KEY):
+            return jsonify({'success': False, 'error': 'This site is configured in the tenants file (NOTION_TENANTS_PATH)'})
+        
         # Update .env file
         success, message = update_env_file(token, database_id, guide_database_id, message_property, name_property, barcode_properties, mastercode_property, route_property)
         
         if success:
+            # Pick up the new settings now rather than waiting for the file watcher
+            context.invalidate()
             return jsonify({'success': True, 'message': message})
         else:
             return jsonify({'success': False, 'error': message})
@@ -289,7 +620,9 @@ def test_credentials():
         
         # Test the credentials
         try:
-            notion = Client(auth=token)
+            from notion_client import Client
+            
+            notion = Client(auth=token, base_url=os.getenv('NOTION_BASE_URL') or 'https://api.notion.com')
             # Try to get database info
             database = notion.databases.retrieve(database_id)
             return jsonify({
@@ -306,52 +639,111 @@ def test_credentials():
 @app.route('/store', methods=['POST'])
 def store_message():
     """Store a message in Notion database"""
-    global last_entry_id
+    started = time.perf_counter()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        # Not a JSON object, handle_scan answers it with an error
+        data = {}
+    station_id = get_station_id(data)
+    tenant = get_tenant(station_id)
+    # Station IDs only have to be unique within a tenant
+    station = tenant.station_key(station_id)
+    key, previous_key, max_age = idempotency_keys(data, station)
+    
+    owner = False
+    result = None
+    if key:
+        cache = get_idempotency_cache()
+        if previous_key:
+            result = cache.get(previous_key, max_age)
+        if result is None:
+            result, owner = cache.begin(key, max_age)
     
+    if result is not None:
+        # Seen this scan already, answer as before without contacting Notion
+        response = jsonify(dict(result, duplicate=True))
+        outcome = 'duplicate'
+    else:
+        try:
+            with use_tenant(tenant):
+                response = handle_scan(station)
+            result = response.get_json()
+        finally:
+            if owner:
+                # Only successes are remembered, a failed scan may be retried
+                get_idempotency_cache().complete(key, result if result and result.get('success') else None)
+        outcome = 'failed' if not result.get('success') else 'queued' if result.get('queued') else 'stored'
+    
+    # Count the scan by what happened to it
+    kind = 'mastercode' if result.get('is_mastercode') else 'item'
+    SCANS.inc(kind, outcome)
+    SCAN_SECONDS.observe(time.perf_counter() - started, kind)
+    return response
+
+def handle_scan(station):
+    """Handle one /store request from a station of the current tenant, returning its JSON response"""
     try:
         # Get message from request
         data = request.get_json()
-        message = data.get('message', '')
+        message = data.get('message', '') if isinstance(data, dict) else ''
+        # Identifies this scan's entry if it has to be replayed from the journal
+        scan_id = uuid.uuid4().hex
         
-        print(f"🔍 Received message: {message}")
+        logger.debug("Received scan", extra={'scan': message, 'station': station})
         
         if not message:
             return jsonify({'success': False, 'error': 'No message provided'})
         
-        # Load environment
-        notion_token, database_id, guide_database_id, message_property, name_property, barcode_properties, mastercode_property, route_property = load_environment()
-        
-        print(f"🔍 Environment loaded:")
-        print(f"  - Database ID: {database_id}")
-        print(f"  - Guide Database ID: {guide_database_id}")
+        # Cached configuration, reloaded by the context when .env changes
+        with span('env_load'):
+            notion_token, database_id, guide_database_id, message_property, name_property, barcode_properties, mastercode_property, route_property = tenant_context().config()
         
         if not notion_token or not database_id:
             return jsonify({'success': False, 'error': 'Notion credentials not configured'})
         
-        # Initialize Notion client
-        notion = Client(auth=notion_token)
+        # The tenant's shared Notion client with pooled keep-alive connections
+        notion = tenant_context().client()
         
         # Check if this is a master code in the Guide database
+        is_mastercode, route_value = False, None
         if guide_database_id:
-            print(f"🔍 Checking Guide database for master code: {message}")
-            is_mastercode, route_value = check_guide_database(notion, guide_database_id, message, mastercode_property, route_property)
-            
-            print(f"🔍 Master code check result:")
-            print(f"  - Is master code: {is_mastercode}")
-            print(f"  - Route value: {route_value}")
+            with span('guide_lookup'):
+                is_mastercode, route_value = lookup_mastercode(notion, notion_token, guide_database_id, message, mastercode_property, route_property)
+            logger.debug("Guide lookup", extra={'scan': message, 'is_mastercode': is_mastercode, 'route': route_value})
+        
+        publish_event('scan_accepted', station, message=message, is_mastercode=is_mastercode,
+                      route=route_value if is_mastercode else None)
+        
+        if write_behind_enabled():
+            # Acknowledge right away, the queue workers write to Notion in the background
+            # A mastercode targets the station's last entry as of now, not when it is sent
+            scan_id = get_scan_queue().enqueue(message, station, route_value if is_mastercode else None,
+                                               get_station_store().get_last_entry(station))
+            logger.debug("Queued scan", extra={'queue_id': scan_id, 'station': station})
             
+            return jsonify({
+                'success': True,
+                'message': 'Scan queued',
+                'scan_id': scan_id,
+                'queued': True,
+                'is_mastercode': is_mastercode
+            })
+        
+        if should_queue_offline(station):
+            # Notion is unreachable (or this station's earlier scans are still waiting), keep the scan locally
+            return offline_response(queue_offline(message, station, route_value if is_mastercode else None, scan_id), is_mastercode)
+        
+        if guide_database_id:
             if is_mastercode:
-                print(f"🔍 Processing as master code")
                 # This is a master code, update the previous entry's barcode
                 
-                # Try to use the global last entry ID first, then fall back to database query
-                entry_to_update = last_entry_id if last_entry_id else get_last_entry_id(notion, database_id)
-                
-                print(f"🔍 Entry to update: {entry_to_update}")
+                # The last entry this station created, no Notion query needed
+                with span('last_entry'):
+                    entry_to_update = get_station_store().get_last_entry(station)
                 
                 if entry_to_update:
-                    success, result = update_previous_entry(notion, database_id, entry_to_update, route_value, barcode_properties)
-                    print(f"🔍 Update result: {success}, {result}")
+                    success, result = attach_route(notion, station, entry_to_update, route_value)
+                    logger.debug("Route update", extra={'page_id': entry_to_update, 'success': success, 'result': result})
                     
                     if success:
                         return jsonify({
@@ -360,39 +752,40 @@ def store_message():
                             'page_id': entry_to_update,
                             'is_mastercode': True
                         })
+                    elif notion_unreachable():
+                        return offline_response(queue_offline(message, station, route_value, scan_id), True)
                     else:
                         return jsonify({'success': False, 'error': result})
                 else:
                     # No previous entry found, create a new entry with the route as the message
-                    print(f"🔍 No previous entry found, creating new entry with route")
-                    success, result = store_in_notion_database(notion, database_id, route_value, guide_database_id, message_property, name_property)
+                    logger.debug("No previous entry, creating one with the route", extra={'station': station})
+                    success, result = create_entry(notion, station, route_value, None, scan_id)
                     
                     if success:
-                        # Update global last entry ID
-                        last_entry_id = result
-                        
                         return jsonify({
                             'success': True,
                             'message': f'Master code processed. Created new entry with route "{route_value}".',
                             'page_id': result,
                             'is_mastercode': True
                         })
+                    elif notion_unreachable():
+                        # The create may have reached Notion, the replay checks for it by scan ID
+                        return offline_response(queue_offline(message, station, route_value, scan_id, attempts=1), True)
                     else:
                         return jsonify({'success': False, 'error': result})
-            else:
-                print(f"🔍 Not a master code, processing as normal message")
-        else:
-            print(f"🔍 No Guide database configured, processing as normal message")
         
         # Not a master code, store as normal message
-        success, result = store_in_notion_database(notion, database_id, message, guide_database_id, message_property, name_property)
+        success, result = create_entry(notion, station, message, None, scan_id)
+        queued_id = None
+        if not success and notion_unreachable():
+            queued_id = queue_offline(message, station, None, scan_id, attempts=1)
+        
+        logger.debug("Stored scan", extra={'station': station, 'success': success, 'result': result})
         
-        print(f"🔍 Store result: {success}, {result}")
+        if queued_id:
+            return offline_response(queued_id, False)
         
         if success:
-            # Update global last entry ID
-            last_entry_id = result
-            
             return jsonify({
                 'success': True, 
                 'message': 'Message stored successfully',
@@ -403,37 +796,258 @@ def store_message():
             return jsonify({'success': False, 'error': result})
             
     except Exception as e:
-        print(f"❌ Error in store_message: {e}")
+        logger.exception("Error in store_message")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/store/batch', methods=['POST'])
+def store_batch():
+    """Store a stream of scans (JSON Lines or CSV) in Notion, returning per-row results as JSON Lines"""
+    tenant = get_tenant(request.args.get('station'))
+    notion_token, database_id, guide_database_id, message_property, name_property, barcode_properties, mastercode_property, route_property = tenant.context.config()
+    
+    if not notion_token or not database_id:
+        return jsonify({'success': False, 'error': 'Notion credentials not configured'})
+    
+    notion = tenant.context.client()
+    fmt = request.args.get('format') or ('csv' if request.mimetype == 'text/csv' else 'jsonl')
+    concurrency = request.args.get('concurrency', os.getenv('NOTION_BATCH_CONCURRENCY', '3'))
+    try:
+        concurrency = int(concurrency)
+    except ValueError:
+        return jsonify({'success': False, 'error': f'Invalid concurrency: {concurrency!r}'})
+    # Each concurrent write holds a thread, so a client can't ask for more than the configured maximum
+    concurrency = min(max(concurrency, 1), int(os.getenv('NOTION_BATCH_MAX_CONCURRENCY', '16')))
+    
+    title_property = tenant.context.schema_cache.title_property(notion, database_id, [message_property, name_property])
+    if not title_property:
+        return jsonify({'success': False, 'error': 'Could not read the database schema'})
+    properties = tenant.context.schema_cache.properties(notion, database_id)
+    barcode_property = next((name for name in barcode_properties if name in properties), None)
+    
+    def lookup(message):
+        if not guide_database_id:
+            return False, None
+        return lookup_mastercode(notion, notion_token, guide_database_id, message, mastercode_property, route_property)
+    
+    def stream():
+        # The rows are read and looked up while the response streams, after this view has returned
+        with use_tenant(tenant):
+            scans = iter_scans(io.TextIOWrapper(request.stream, encoding='utf-8', newline=''), fmt)
+            for result in run_batch(scans, notion, database_id, title_property, barcode_property, lookup, concurrency):
+                yield json.dumps(result) + '\n'
+    
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson')
+
+@app.route('/store/<int:scan_id>')
+def scan_status(scan_id):
+    """Status of a scan accepted by the write-behind queue"""
+    scan = get_scan_queue(get_tenant(request.args.get('station'))).get(scan_id)
+    if scan is None:
+        return jsonify({'success': False, 'error': 'Scan not found'}), 404
+    
+    return jsonify({
+        'success': True,
+        'scan_id': scan['id'],
+        'status': scan['status'],
+        'page_id': scan['page_id'],
+        'attempts': scan['attempts'],
+        'error': scan['error'],
+        'is_mastercode': scan['action'] == 'update'
+    })
+
+def tenant_state(tenant):
+    """Current state of one tenant's scheduler, caches and queue"""
+    index = tenant.guide_index
+    scan_queue = tenant.scan_queue
+    state = {
+        'scheduler': tenant.context.scheduler.stats(),
+        'circuit_breaker': tenant.context.scheduler.breaker.stats(),
+        'guide_index': None,
+        'queue': None,
+        'schema_cache': {'databases': len(tenant.context.schema_cache), 'ttl_seconds': tenant.context.schema_cache.ttl},
+    }
+    if index is not None:
+        state['guide_index'] = {
+            'ready': index.ready,
+            'mastercodes': len(index),
+            'rules': index.rules.counts,
+            'age_seconds': round(time.time() - index.last_refresh, 1) if index.last_refresh else None,
+            'last_error': index.last_error,
+        }
+    if scan_queue is not None:
+        state['queue'] = {'counts': scan_queue.counts(), 'paused_offline': scan_queue.offline}
+    return state
+
+def live_state(tenant=None):
+    """Current state of a tenant (the default one) and of this process, other tenants under 'tenants'"""
+    tenant = tenant or tenants.default
+    state = tenant_state(tenant)
+    state.update({
+        'stations': len(station_store) if station_store is not None else 0,
+        'idempotency_cache': idempotency_cache.stats() if idempotency_cache is not None else None,
+        'events': event_broker.stats() if event_broker is not None else None,
+        'process': metrics.process_stats(),
+    })
+    # Under a tenant's prefix only that tenant is shown
+    others = [other for other in tenants if not other.is_default] if tenant.is_default else []
+    if others:
+        state['tenants'] = {other.name: tenant_state(other) for other in others}
+    return state
+
+@app.route('/events')
+def live_events():
+    """Server-Sent Events feed of scans, routes and Notion writes as they happen"""
+    tenant = get_tenant() if request.environ.get(ENVIRON_KEY) else None
+    subscription = get_event_broker().subscribe(
+        tenant.name if tenant else None,
+        request.headers.get('Last-Event-ID', type=int)
+    )
+    if subscription is None:
+        return jsonify({'success': False, 'error': 'Too many live feed watchers'}), 503, {'Retry-After': '30'}
+
+    return Response(
+        stream_events(subscription, float(os.getenv('NOTION_EVENTS_HEARTBEAT_SECONDS', '15'))),
+        mimetype='text/event-stream',
+        # Don't let proxies buffer the stream
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/live')
+def live():
+    """Live view of the scans of this site"""
+    try:
+        return render_template('live.html')
+    except Exception as e:
+        return f"""
+        <html>
+        <head><title>Live - Notion for DS</title></head>
+        <body>
+            <h1>Live Feed</h1>
+            <p>Template loading error: {str(e)}</p>
+        </body>
+        </html>
+        """
+
 @app.route('/health')
 def health():
-    """Health check endpoint"""
-    notion_token, database_id, guide_database_id = load_environment()
+    """Health check endpoint with the live state of the caches and queue"""
+    tenant = get_tenant()
+    notion_token, database_id, guide_database_id = tenant.context.config()[:3]
     return jsonify({
         'status': 'healthy',
+        'tenant': tenant.name,
         'notion_configured': bool(notion_token and database_id),
-        'guide_configured': bool(notion_token and guide_database_id)
+        'guide_configured': bool(notion_token and guide_database_id),
+        'write_behind': write_behind_enabled(),
+        'offline_mode': offline_mode_enabled(),
+        'coalesce_window_ms': float(os.getenv('NOTION_COALESCE_WINDOW_MS', '0')),
+        'startup': startup.timings(),
+        **live_state(tenant)
     })
 
-def open_browser(port):
-    """Open browser after a short delay to ensure Flask is running"""
-    time.sleep(1.5)  # Wait for Flask to start
-    webbrowser.open(f'http://localhost:{port}')
+@app.route('/metrics')
+def prometheus_metrics():
+    """Counters, latency histograms and live state in the Prometheus text format"""
+    state = live_state()
+    scheduler = state['scheduler']
+    metrics.NOTION_ONLINE.set(int(scheduler.pop('online')))
+    metrics.SCHEDULER.replace({name: value for name, value in scheduler.items()})
+    breaker = state['circuit_breaker']
+    metrics.CIRCUIT_STATE.set(STATE_VALUES[breaker['state']])
+    metrics.CIRCUIT_BREAKER.replace({'opened': breaker['opened'], 'rejected': breaker['rejected']})
+    metrics.SCHEMA_CACHE_DATABASES.set(state['schema_cache']['databases'])
+    metrics.STATIONS.set(state['stations'])
+    if state['idempotency_cache']:
+        metrics.IDEMPOTENCY_CACHE.replace(state['idempotency_cache'])
+    if state['events']:
+        metrics.LIVE_FEED.replace(state['events'])
+    if state['process']['rss_bytes'] is not None:
+        metrics.PROCESS_RESIDENT_MEMORY.set(state['process']['rss_bytes'])
+    metrics.PROCESS_THREADS.set(state['process']['threads'])
+    if state['guide_index']:
+        metrics.GUIDE_INDEX_MASTERCODES.set(state['guide_index']['mastercodes'])
+        metrics.GUIDE_INDEX_RULES.replace(state['guide_index']['rules'])
+        if state['guide_index']['age_seconds'] is not None:
+            metrics.GUIDE_INDEX_AGE.set(state['guide_index']['age_seconds'])
+    if state['queue']:
+        metrics.QUEUE_SCANS.replace(state['queue']['counts'])
+    if 'tenants' in state:
+        metrics.TENANT_NOTION_ONLINE.replace({name: int(tenant['scheduler']['online']) for name, tenant in state['tenants'].items()})
+        metrics.TENANT_CIRCUIT_STATE.replace({name: STATE_VALUES[tenant['circuit_breaker']['state']] for name, tenant in state['tenants'].items()})
+        metrics.TENANT_QUEUE_SCANS.replace({
+            (name, status): count
+            for name, tenant in state['tenants'].items() if tenant['queue']
+            for status, count in tenant['queue']['counts'].items()
+        })
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+def prewarm_tenant(tenant):
+    """Load everything the first scan of a tenant needs"""
+    notion_token, database_id, guide_database_id, message_property, name_property, barcode_properties, mastercode_property, route_property = tenant.context.config()
+    if notion_token and database_id:
+        # Imports the Notion client, opens the connection and caches the database schema
+        try:
+            tenant.context.schema_cache.properties(tenant.context.client(), database_id)
+        except Exception as e:
+            logger.warning("Could not pre-warm the Notion client", extra={'tenant': tenant.name, 'error': str(e)})
+    
+    # Build the Guide index up front so the first scans don't pay for it
+    if notion_token and guide_database_id:
+        get_guide_index(notion_token, guide_database_id, mastercode_property, route_property)
+    
+    # Resume sending anything left in the queue by a previous run
+    if write_behind_enabled() or offline_mode_enabled():
+        get_scan_queue(tenant)
+
+def prewarm():
+    """Load everything the first scan needs, so it isn't slowed by a cold start"""
+    # Reload settings whenever .env is edited
+    context.start_watcher()
+    
+    for tenant in tenants:
+        with use_tenant(tenant):
+            prewarm_tenant(tenant)
+    
+    startup.mark('prewarmed_ms')
+    logger.info("Pre-warmed", extra=startup.timings())
+
+def start_background_services():
+    """Start the threads that keep caches fresh and drain the queue (once per worker process)"""
+    # Log level and format come from .env, so read it first
+    context.config()
+    configure_logging(os.getenv('NOTION_LOG_LEVEL', 'INFO'), os.getenv('NOTION_LOG_FORMAT', 'text'))
+    
+    # Warm up in the background so the server starts answering right away
+    threading.Thread(target=prewarm, name='prewarm', daemon=True).start()
+
+def run_server(port, sock=None):
+    """Serve the app with the server selected by NOTION_SERVER, on ``sock`` if already listening"""
+    server = os.getenv('NOTION_SERVER', 'waitress')
+    threads = int(os.getenv('NOTION_SERVER_THREADS', '8'))
+    
+    if server == 'waitress':
+        # Multi-threaded production server, pure Python so it also runs in the frozen build
+        from waitress import create_server
+        if sock is not None:
+            http_server = create_server(app, sockets=[sock], threads=threads)
+        else:
+            http_server = create_server(app, host='0.0.0.0', port=port, threads=threads)
+        startup.mark('serving_ms')
+        logger.info("Serving with waitress", extra={'port': port, 'threads': threads, **startup.timings()})
+        http_server.run()
+    elif server == 'flask':
+        # Development server; debug mode and the reloader stay off for bundled apps
+        from werkzeug.serving import make_server
+        http_server = make_server('0.0.0.0', port, app, threaded=True, fd=sock.fileno() if sock is not None else None)
+        startup.mark('serving_ms')
+        logger.info("Serving with the Flask development server", extra={'port': port, **startup.timings()})
+        http_server.serve_forever()
+    else:
+        raise ValueError(f"Unknown NOTION_SERVER: {server} (expected waitress or flask)")
 
 if __name__ == '__main__':
     # Production-safe settings for PyInstaller bundling
     port = int(os.environ.get('PORT', 5001))  # Changed default port to avoid conflicts
     
-    # Open browser automatically (only when run directly, not in production)
-    if not getattr(sys, 'frozen', False):  # Only open browser in development
-        browser_thread = threading.Thread(target=open_browser, args=(port,))
-        browser_thread.daemon = True
-        browser_thread.start()
-    
-    app.run(
-        debug=False,  # Disable debug mode for production
-        use_reloader=False,  # Disable reloader for bundled apps
-        host='0.0.0.0', 
-        port=port
-    ) 
\ No newline at end of file
+    start_background_services()
+    run_server(port, startup.take_socket())
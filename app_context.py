@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Application-level context: cached configuration and a shared Notion client
+"""
+
+import logging
+import os
+import threading
+
+from notion_scheduler import RequestScheduler
+from schema_cache import SchemaCache
+
+logger = logging.getLogger(__name__)
+
+
+class AppContext:
+    """Owns the parsed configuration and one long-lived Notion client.
+
+    ``loader`` is called to parse the configuration (``load_environment`` in
+    app.py) and must return a tuple whose first item is the Notion token. The
+    result and the client built from it are swapped in together, so a request
+    never sees a new configuration paired with an old client or vice versa.
+    Database schemas cached in ``schema_cache`` are dropped on every reload.
+    Every request the client makes is paced by ``scheduler``. ``NOTION_BASE_URL``
+    points the client at another API endpoint, such as the local stand-in in
+    fake_notion.py. ``rate``, ``burst`` and ``base_url`` override those .env
+    settings for this context alone (see tenants.py). The rate and burst are
+    divided by ``NOTION_WORKER_PROCESSES``, so the processes together stay
+    within them.
+    """
+
+    def __init__(self, loader, env_path='.env', watch_interval=None, max_connections=20, rate=None, burst=None,
+                 base_url=None):
+        self.loader = loader
+        self.env_path = env_path
+        self.watch_interval = watch_interval
+        self.max_connections = max_connections
+        self.rate = rate
+        self.burst = burst
+        self.base_url = base_url
+
+        self.schema_cache = SchemaCache()
+        self.scheduler = RequestScheduler()
+        self._state = None
+        self._base_url = None
+        self._env_mtime = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def _env_file_mtime(self):
+        try:
+            return os.stat(self.env_path).st_mtime
+        except OSError:
+            return None
+
+    def _build_client(self, notion_token, base_url=None):
+        if not notion_token:
+            return None
+        # Imported here so the app can start serving before the Notion client library has loaded
+        import httpx
+        from scheduled_client import ScheduledClient
+
+        # Keep connections alive between scans instead of a new TLS handshake per request
+        http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+        )
+        return ScheduledClient(self.scheduler, auth=notion_token, client=http_client,
+                               base_url=base_url or 'https://api.notion.com')
+
+    def _load(self):
+        self._env_mtime = self._env_file_mtime()
+        from dotenv import load_dotenv
+
+        # On reload, edits to .env must replace the values loaded earlier in this process
+        load_dotenv(self.env_path, override=self._state is not None)
+        config = self.loader()
+        self.schema_cache.ttl = float(os.getenv('NOTION_SCHEMA_TTL_SECONDS', '300'))
+        self.schema_cache.invalidate()
+        # Worker processes (see gunicorn.conf.py) split the rate limit between them
+        workers = max(int(os.getenv('NOTION_WORKER_PROCESSES', '1')), 1)
+        self.scheduler.rate = float(self.rate or os.getenv('NOTION_RATE_LIMIT', '3')) / workers
+        self.scheduler.burst = max(float(self.burst or os.getenv('NOTION_RATE_BURST', '3')) / workers, 1.0)
+        self.scheduler.read_timeout = float(os.getenv('NOTION_TIMEOUT_SECONDS', '15'))
+        self.scheduler.write_timeout = float(os.getenv('NOTION_WRITE_TIMEOUT_SECONDS', '8'))
+        self.scheduler.breaker.failure_threshold = int(os.getenv('NOTION_BREAKER_FAILURES', '5'))
+        self.scheduler.breaker.reset_timeout = float(os.getenv('NOTION_BREAKER_RESET_SECONDS', '30'))
+
+        base_url = self.base_url or os.getenv('NOTION_BASE_URL') or None
+        previous = self._state
+        if previous is not None and previous[0][0] == config[0] and self._base_url == base_url:
+            client = previous[1]
+        else:
+            client = self._build_client(config[0], base_url)
+        self._base_url = base_url
+        self._state = (config, client)
+        return self._state
+
+    def _current(self):
+        state = self._state
+        if state is None:
+            with self._lock:
+                state = self._state or self._load()
+        return state
+
+    def config(self):
+        """Return the cached configuration tuple"""
+        return self._current()[0]
+
+    def client(self):
+        """Return the shared Notion client, or None when no token is configured"""
+        return self._current()[1]
+
+    def invalidate(self):
+        """Re-read the configuration now, replacing the cached copy atomically"""
+        with self._lock:
+            self._load()
+
+    def _watch(self):
+        while not self._stop.wait(self.watch_interval):
+            if self._env_file_mtime() != self._env_mtime:
+                logger.info("Configuration file changed, reloading", extra={'path': self.env_path})
+                try:
+                    self.invalidate()
+                except Exception as e:
+                    logger.error("Error reloading configuration", extra={'error': str(e)})
+
+    def start_watcher(self):
+        """Reload the configuration whenever the .env file changes on disk"""
+        if self.watch_interval is None:
+            self.watch_interval = float(os.getenv('NOTION_ENV_WATCH_SECONDS', '2'))
+        if self._watcher is None:
+            self._watcher = threading.Thread(target=self._watch, name='env-watcher', daemon=True)
+            self._watcher.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
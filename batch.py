@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Bulk ingestion of scans collected offline
+"""
+
+import csv
+import itertools
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def page_properties(title_property, message, barcode_property=None, route=None, scan_id_property=None, scan_id=None):
+    """Build the properties of a new entry, optionally with its route and scan ID already set"""
+    properties = {
+        title_property: {
+            "title": [
+                {
+                    "text": {
+                        "content": message
+                    }
+                }
+            ]
+        }
+    }
+    if barcode_property and route is not None:
+        properties[barcode_property] = {
+            "select": {
+                "name": route
+            }
+        }
+    if scan_id_property and scan_id:
+        properties[scan_id_property] = {
+            "rich_text": [
+                {
+                    "text": {
+                        "content": scan_id
+                    }
+                }
+            ]
+        }
+    return properties
+
+
+def iter_scans(lines, fmt='jsonl'):
+    """Yield (row, message, error) for each scan in a JSON Lines or CSV stream of text lines.
+
+    JSON Lines rows are objects with a ``message`` field (or bare strings); CSV
+    rows use the ``message`` column, or the first column when there is none.
+    The first CSV row is only a header if it has a ``message`` column,
+    otherwise it is a scan like the others.
+    """
+    if fmt == 'csv':
+        reader = csv.reader(lines)
+        header = next(reader, None)
+        if header is None:
+            return
+        names = [name.strip().lower() for name in header]
+        if 'message' in names:
+            column, first_row, rows = names.index('message'), 2, reader
+        else:
+            column, first_row, rows = 0, 1, itertools.chain([header], reader)
+        for row, values in enumerate(rows, first_row):
+            if not values:
+                continue
+            if column < len(values) and values[column].strip():
+                yield row, values[column].strip(), None
+            else:
+                yield row, None, 'No message provided'
+        return
+
+    for row, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield row, None, f"Invalid JSON: {e}"
+            continue
+        message = data.get('message', '') if isinstance(data, dict) else data
+        if message:
+            yield row, str(message), None
+        else:
+            yield row, None, 'No message provided'
+
+
+def plan_entries(scans, lookup_mastercode):
+    """Group scans into the entries they produce, streaming.
+
+    Mirrors /store: a mastercode applies its route to the entry scanned before
+    it (the last one wins), and one with no entry before it creates an entry
+    with the route as the message. Rows that can't be parsed are yielded as
+    ``{'row', 'message', 'error'}`` so they still get a result.
+    """
+    pending = None
+    for row, message, error in scans:
+        if error:
+            yield {'row': row, 'message': message, 'error': error}
+            continue
+
+        is_mastercode, route = lookup_mastercode(message)
+        if is_mastercode:
+            if pending is None:
+                pending = {'row': row, 'code': message, 'message': route, 'route': None, 'is_mastercode': True, 'mastercodes': []}
+            else:
+                pending['route'] = route
+                pending['mastercodes'].append({'row': row, 'message': message, 'route': route})
+            continue
+
+        if pending is not None:
+            yield pending
+        pending = {'row': row, 'code': message, 'message': message, 'route': None, 'is_mastercode': False, 'mastercodes': []}
+
+    if pending is not None:
+        yield pending
+
+
+def write_entry(client, database_id, title_property, barcode_property, entry):
+    """Create one planned entry with a single pages.create, returning its per-row results"""
+    try:
+        response = client.pages.create(
+            parent={"database_id": database_id},
+            properties=page_properties(title_property, entry['message'], barcode_property, entry['route'])
+        )
+        success, page_id, error = True, response['id'], None
+    except Exception as e:
+        success, page_id, error = False, None, str(e)
+
+    results = [{'row': entry['row'], 'message': entry['code'], 'is_mastercode': entry['is_mastercode'],
+                'success': success, 'page_id': page_id, 'error': error}]
+    for mastercode in entry['mastercodes']:
+        mastercode_error = error
+        if success and not barcode_property:
+            mastercode_error = "Barcode property not found"
+        results.append({'row': mastercode['row'], 'message': mastercode['message'], 'is_mastercode': True,
+                        'route': mastercode['route'], 'success': mastercode_error is None,
+                        'page_id': page_id, 'error': mastercode_error})
+    return results
+
+
+def run_batch(scans, client, database_id, title_property, barcode_property, lookup_mastercode, concurrency=3):
+    """Write a stream of scans to Notion, yielding per-row results as they complete.
+
+    At most ``concurrency`` creates run at once and only twice that many
+    entries are held in memory, so arbitrarily long inputs stream through. The
+    last item yielded is a summary with the overall throughput.
+    """
+    started = time.perf_counter()
+    counts = {'rows': 0, 'succeeded': 0, 'failed': 0, 'entries': 0}
+
+    def tally(results):
+        for result in results:
+            counts['rows'] += 1
+            counts['succeeded' if result['success'] else 'failed'] += 1
+        return results
+
+    in_flight = set()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for entry in plan_entries(scans, lookup_mastercode):
+            if 'error' in entry:
+                yield from tally([{'row': entry['row'], 'message': entry['message'], 'success': False,
+                                   'page_id': None, 'error': entry['error']}])
+                continue
+
+            counts['entries'] += 1
+            in_flight.add(executor.submit(write_entry, client, database_id, title_property, barcode_property, entry))
+            if len(in_flight) >= concurrency * 2:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from tally(future.result())
+
+        for future in in_flight:
+            yield from tally(future.result())
+
+    seconds = time.perf_counter() - started
+    yield dict(counts, summary=True, seconds=round(seconds, 3),
+               rows_per_second=round(counts['rows'] / seconds, 2) if seconds else None)
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the /store scan pipeline against a local fake Notion API
+
+Runs the web app in this process, points it at fake_notion.py and drives
+/store with a mix of item and mastercode scans from concurrent stations:
+
+    python bench.py --concurrency 1,4,16 --scans 400 --latency-ms 150
+
+For every concurrency level it reports p50/p95/p99 latency, Notion calls per
+scan and scans per second, and appends the run to a JSON Lines results file.
+With --compare the run is checked against the last recorded run with the same
+settings and the exit code is non-zero if it got slower.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+import httpx
+
+from fake_notion import FakeNotion, start_fake_notion
+
+# Guide entries scanned as mastercodes
+MASTERCODES = {f'MC-{n:03d}': f'Route-{n}' for n in range(20)}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))]
+
+
+def station_scans(station, count, mastercode_ratio, rng):
+    """Scans one station sends: each item is followed by its mastercode ``mastercode_ratio`` of the time"""
+    scans = []
+    while len(scans) < count:
+        scans.append(f'ITEM-{station}-{len(scans)}')
+        if len(scans) < count and rng.random() < mastercode_ratio:
+            scans.append(rng.choice(list(MASTERCODES)))
+    return scans
+
+
+def configure_environment(args, fake_url, work_dir):
+    """Settings for the app under test, taken from the command line instead of .env"""
+    os.environ.update({
+        'NOTION_TOKEN': 'bench-token',
+        'NOTION_BASE_URL': fake_url,
+        'NOTION_DATABASE_ID': 'fake-database',
+        'NOTION_GUIDE_DATABASE_ID': 'fake-guide',
+        'NOTION_BARCODE_PROPERTIES': 'Barcode',
+        'NOTION_SCAN_ID_PROPERTY': '',
+        'NOTION_RATE_LIMIT': str(args.rate_limit),
+        'NOTION_RATE_BURST': str(max(3, int(args.rate_limit))),
+        'NOTION_WRITE_BEHIND': 'true' if args.write_behind else 'false',
+        'NOTION_OFFLINE_MODE': 'false',
+        'NOTION_COALESCE_WINDOW_MS': str(args.coalesce_ms),
+        'NOTION_QUEUE_PATH': os.path.join(work_dir, 'scan_queue.db'),
+        'NOTION_GUIDE_CACHE_PATH': '',
+        # No background refreshes in the middle of a measurement
+        'NOTION_GUIDE_REFRESH_SECONDS': '3600',
+        'NOTION_STATION_BACKEND': 'memory',
+        'NOTION_LOG_LEVEL': 'WARNING',
+        # Stations here scan far faster than a person, repeats are not double-fires
+        'NOTION_DEBOUNCE_MS': '0',
+    })
+
+
+def start_app(threads):
+    """Serve the app on a free local port with waitress, returning (app module, server)"""
+    from waitress import create_server
+
+    import app as web_app
+    # Configuration comes from the environment only, never from a local .env
+    web_app.context.env_path = os.devnull
+    web_app.start_background_services()
+
+    server = create_server(web_app.app, host='127.0.0.1', port=0, threads=threads)
+    threading.Thread(target=server.run, name='bench-server', daemon=True).start()
+    return web_app, server
+
+
+def wait_for_queue(web_app, timeout):
+    """Wait until the write-behind queue has sent everything"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        counts = web_app.get_scan_queue().counts()
+        if not counts.get('pending') and not counts.get('sending'):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def run_level(base_url, api, web_app, concurrency, args, rng, run_id):
+    """Drive /store from ``concurrency`` stations at once and measure the result"""
+    per_station = max(1, args.scans // concurrency)
+    stations = {f'{run_id}-c{concurrency}-s{i}': None for i in range(concurrency)}
+    for station in stations:
+        stations[station] = station_scans(station, per_station, args.mastercode_ratio, rng)
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def drive(station, scans):
+        # One scanner sends its scans one after another, like a person at a station
+        with httpx.Client(base_url=base_url, timeout=120) as client:
+            for message in scans:
+                started = time.perf_counter()
+                try:
+                    result = client.post('/store', json={'message': message, 'station': station}).json()
+                    error = None if result.get('success') else result.get('error')
+                except Exception as e:
+                    error = str(e)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed * 1000)
+                    if error:
+                        errors.append(error)
+
+    pages_before = len(api.pages)
+    api.reset_stats()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda item: drive(*item), stations.items()))
+    drained = wait_for_queue(web_app, args.drain_timeout) if args.write_behind else True
+    seconds = time.perf_counter() - started
+
+    scans = len(latencies)
+    stats = api.stats()
+    return {
+        'concurrency': concurrency,
+        'scans': scans,
+        'errors': len(errors),
+        'sample_error': errors[0] if errors else None,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'max_ms': round(max(latencies), 2),
+        'seconds': round(seconds, 3),
+        'scans_per_second': round(scans / seconds, 2),
+        'notion_calls': stats['total_calls'],
+        'notion_calls_per_scan': round(stats['total_calls'] / scans, 3),
+        'calls_by_endpoint': stats['calls'],
+        'injected_failures': stats['injected'],
+        'entries_created': len(api.pages) - pages_before,
+        'drained': drained,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_baseline(path, settings):
+    """Return the last recorded run with the same settings, or None"""
+    if not os.path.exists(path):
+        return None
+    baseline = None
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                if record.get('settings') == settings:
+                    baseline = record
+    return baseline
+
+
+def compare(results, baseline, tolerance):
+    """Return a description of every regression against ``baseline``"""
+    previous = {level['concurrency']: level for level in baseline['levels']}
+    regressions = []
+    for level in results:
+        before = previous.get(level['concurrency'])
+        if before is None:
+            continue
+        name = f"concurrency {level['concurrency']}"
+        if level['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {level['p95_ms']}ms")
+        if level['scans_per_second'] < before['scans_per_second'] * (1 - tolerance):
+            regressions.append(f"{name}: {before['scans_per_second']} -> {level['scans_per_second']} scans/s")
+        if level['notion_calls_per_scan'] > before['notion_calls_per_scan'] + 0.01:
+            regressions.append(f"{name}: {before['notion_calls_per_scan']} -> "
+                               f"{level['notion_calls_per_scan']} Notion calls/scan")
+        if level['errors'] > before['errors']:
+            regressions.append(f"{name}: {before['errors']} -> {level['errors']} failed scans")
+    return regressions
+
+
+def print_table(results):
+    print(f"{'conc':>5} {'scans':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'scans/s':>9} {'calls/scan':>11}")
+    for level in results:
+        print(f"{level['concurrency']:>5} {level['scans']:>6} {level['errors']:>6} {level['p50_ms']:>9} "
+              f"{level['p95_ms']:>9} {level['p99_ms']:>9} {level['scans_per_second']:>9} "
+              f"{level['notion_calls_per_scan']:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark /store against a local fake Notion API')
+    parser.add_argument('--concurrency', default='1,4,16',
+                        help='comma-separated numbers of stations scanning at once')
+    parser.add_argument('--scans', type=int, default=200, help='scans sent per concurrency level')
+    parser.add_argument('--mastercode-ratio', type=float, default=0.5,
+                        help='fraction of items followed by a mastercode scan')
+    parser.add_argument('--latency-ms', type=float, default=100, help='fake Notion latency per request')
+    parser.add_argument('--jitter-ms', type=float, default=50, help='random extra fake Notion latency')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of Notion requests failing with 500')
+    parser.add_argument('--rate-limited-rate', type=float, default=0,
+                        help='fraction of Notion requests answered with 429')
+    parser.add_argument('--retry-after', type=float, default=1, help='Retry-After seconds sent with a 429')
+    parser.add_argument('--rate-limit', type=float, default=1000,
+                        help="the app's NOTION_RATE_LIMIT (use 3 to include Notion's real limit)")
+    parser.add_argument('--write-behind', action='store_true', help='benchmark with NOTION_WRITE_BEHIND on')
+    parser.add_argument('--coalesce-ms', type=float, default=0,
+                        help="the app's NOTION_COALESCE_WINDOW_MS (only used with --write-behind)")
+    parser.add_argument('--drain-timeout', type=float, default=300,
+                        help='seconds to wait for the write-behind queue to empty')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the scan mix')
+    parser.add_argument('--output', default='bench_results.jsonl', help='JSON Lines file runs are appended to')
+    parser.add_argument('--compare', action='store_true',
+                        help='fail if slower than the last recorded run with the same settings')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown before --compare reports a regression (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    levels = [int(value) for value in args.concurrency.split(',')]
+    settings = {name: getattr(args, name) for name in (
+        'scans', 'mastercode_ratio', 'latency_ms', 'jitter_ms', 'error_rate', 'rate_limited_rate',
+        'retry_after', 'rate_limit', 'write_behind', 'coalesce_ms', 'seed')}
+    settings['concurrency'] = levels
+
+    random.seed(args.seed)
+    api = FakeNotion(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, error_rate=args.error_rate,
+                     rate_limited_rate=args.rate_limited_rate, retry_after=args.retry_after)
+    for mastercode, route in MASTERCODES.items():
+        api.add_guide_entry(mastercode, route)
+    fake = start_fake_notion(api=api)
+
+    # The app's own per-scan output would drown the report
+    with tempfile.TemporaryDirectory() as work_dir, open(os.devnull, 'w') as quiet, redirect_stdout(quiet):
+        configure_environment(args, fake.url, work_dir)
+        web_app, server = start_app(threads=max(levels) + 4)
+        base_url = f'http://127.0.0.1:{server.effective_port}'
+        print(f"⏱️  Benchmarking {base_url} against fake Notion at {fake.url}", file=sys.stderr)
+
+        # Build the Guide index and warm the schema cache before measuring
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            for _ in range(200):
+                guide_index = web_app.tenants.default.guide_index
+                if client.get('/health').status_code == 200 and guide_index and guide_index.ready:
+                    break
+                time.sleep(0.05)
+            client.post('/store', json={'message': 'warm-up', 'station': 'warm-up'})
+        if args.write_behind:
+            wait_for_queue(web_app, args.drain_timeout)
+
+        rng = random.Random(args.seed)
+        run_id = datetime.now(timezone.utc).strftime('%H%M%S')
+        results = []
+        for concurrency in levels:
+            result = run_level(base_url, api, web_app, concurrency, args, rng, run_id)
+            results.append(result)
+            print(f"  concurrency {concurrency}: {result['scans_per_second']} scans/s, p95 {result['p95_ms']}ms",
+                  file=sys.stderr)
+        if args.write_behind:
+            web_app.get_scan_queue().stop()
+
+    print()
+    print_table(results)
+
+    exit_code = 0
+    if args.compare:
+        baseline = load_baseline(args.output, settings)
+        if baseline is None:
+            print(f"\nNo earlier run with these settings in {args.output}, nothing to compare")
+        else:
+            regressions = compare(results, baseline, args.tolerance)
+            if regressions:
+                print(f"\n❌ Slower than the run recorded at {baseline['recorded_at']} ({baseline['commit']}):")
+                for regression in regressions:
+                    print(f"  - {regression}")
+                exit_code = 1
+            else:
+                print(f"\n✅ No regressions against the run recorded at {baseline['recorded_at']} ({baseline['commit']})")
+
+    record = {
+        'recorded_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'settings': settings,
+        'levels': results,
+    }
+    with open(args.output, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+    print(f"📝 Results appended to {args.output}")
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Circuit breaker that stops sending requests to Notion while it is down
+"""
+
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Gauge values of the states in /metrics
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """A Notion request refused without being sent, because the circuit is open"""
+
+    def __init__(self, retry_in):
+        super().__init__(f"Notion is not responding, requests paused for {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Fails Notion requests fast after ``failure_threshold`` failures in a row.
+
+    Timeouts, connection errors and server errors count as failures; any
+    answer from Notion (even a 4xx) counts as a success. Once open, requests
+    are refused for ``reset_timeout`` seconds, then a single probe request is
+    let through (half-open): if it succeeds the circuit closes again, if it
+    fails it stays open for another ``reset_timeout``.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        return self._state
+
+    def allow(self):
+        """Return whether a request may be sent now, raising CircuitOpenError if not"""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            retry_in = self._opened_at + self.reset_timeout - time.monotonic()
+            if self._state == OPEN and retry_in <= 0:
+                self._state = HALF_OPEN
+            if self._state == HALF_OPEN and not self._probing:
+                # This caller's request is the probe
+                self._probing = True
+                return True
+            self.rejected += 1
+        raise CircuitOpenError(max(retry_in, 0))
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            self._state = CLOSED
+
+    def release(self):
+        """Give back a probe that got no answer from Notion, leaving the state as it is"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self.opened += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'opened': self.opened,
+                'rejected': self.rejected,
+                'retry_in_seconds': round(max(self._opened_at + self.reset_timeout - time.monotonic(), 0), 1)
+                if self._state == OPEN else None,
+            }
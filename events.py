@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Live feed of scan events, fanned out to Server-Sent Events subscribers
+"""
+
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+
+class Subscription:
+    """One watcher's bounded buffer of events.
+
+    When the watcher falls ``max_buffer`` events behind, the oldest are
+    dropped (and counted) rather than letting the buffer grow.
+    """
+
+    def __init__(self, broker, tenant=None, max_buffer=100):
+        self.broker = broker
+        self.tenant = tenant
+        self.dropped = 0
+        self._events = deque(maxlen=max_buffer)
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def _push(self, event):
+        with self._cond:
+            if len(self._events) == self._events.maxlen:
+                self.dropped += 1
+            self._events.append(event)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Return the events buffered since the last call, waiting up to ``timeout`` seconds for one"""
+        with self._cond:
+            if not self._events and not self._closed:
+                self._cond.wait(timeout)
+            events = list(self._events)
+            self._events.clear()
+            return events
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        self.broker.unsubscribe(self)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class EventBroker:
+    """Publishes events from the scan pipeline to every subscriber without ever blocking it.
+
+    Each event gets an increasing ID and is kept in a short ``history`` so a
+    reconnecting watcher (``Last-Event-ID``) doesn't miss what happened while
+    it was away. At most ``max_subscribers`` watchers are served at once, since
+    each holds a server thread for as long as it is connected.
+    """
+
+    def __init__(self, max_subscribers=4, max_buffer=100, history=100):
+        self.max_subscribers = max_subscribers
+        self.max_buffer = max_buffer
+        self._subscribers = []
+        self._history = deque(maxlen=history)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.published = 0
+        # Events dropped by watchers that have since disconnected
+        self._dropped_before = 0
+
+    def publish(self, event_type, tenant=None, **data):
+        """Send an event to every subscriber watching its tenant"""
+        with self._lock:
+            event = {'id': next(self._ids), 'type': event_type, 'time': time.time(), 'tenant': tenant, **data}
+            self._history.append(event)
+            self.published += 1
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            if subscription.tenant is None or subscription.tenant == tenant:
+                subscription._push(event)
+        return event
+
+    def subscribe(self, tenant=None, last_event_id=None):
+        """Return a new Subscription (None when full), primed with the events after ``last_event_id``"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscription = Subscription(self, tenant, self.max_buffer)
+            if last_event_id is not None:
+                for event in self._history:
+                    if event['id'] > last_event_id and (tenant is None or event['tenant'] == tenant):
+                        subscription._push(event)
+            self._subscribers.append(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+                self._dropped_before += subscription.dropped
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'published': self.published,
+                'dropped': self._dropped_before + sum(subscription.dropped for subscription in self._subscribers),
+            }
+
+
+def format_event(event):
+    """Encode an event in the ``text/event-stream`` format"""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def stream_events(subscription, heartbeat=15.0):
+    """Yield a subscription's events as ``text/event-stream`` chunks until the client goes away.
+
+    A comment line is sent every ``heartbeat`` seconds without events, which
+    keeps proxies from closing the connection and notices a watcher that
+    disconnected. Events dropped because the watcher fell behind are reported
+    in a ``dropped`` event.
+    """
+    reported = 0
+    try:
+        yield "retry: 3000\n\n"
+        while not subscription.closed:
+            events = subscription.get(heartbeat)
+            if subscription.dropped > reported:
+                yield f"event: dropped\ndata: {json.dumps({'dropped': subscription.dropped - reported})}\n\n"
+                reported = subscription.dropped
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            yield ''.join(format_event(event) for event in events)
+    finally:
+        subscription.close()
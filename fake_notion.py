@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the parts of the Notion API this app uses
+
+Point the app at it with NOTION_BASE_URL to try offline mode, replay and
+the batch tools without a Notion workspace:
+
+    python fake_notion.py --port 8765 --guide M100=Dock-A --rule prefix:R1=Dock-B
+    NOTION_BASE_URL=http://localhost:8765 python app.py
+
+Latency, server errors and rate limiting can be injected to see how the app
+behaves under a slow or struggling API (bench.py uses this).
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DATABASE_ID = 'fake-database'
+GUIDE_DATABASE_ID = 'fake-guide'
+
+# Property schemas of the two databases, as returned by databases.retrieve
+DATABASE_PROPERTIES = {
+    'Message': 'title',
+    'Barcode': 'select',
+    'Scan ID': 'rich_text',
+}
+GUIDE_PROPERTIES = {
+    'Mastercode': 'title',
+    'Route': 'rich_text',
+    'Match': 'select',
+    'Check Digit': 'checkbox',
+}
+
+
+def timestamp():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def rich_text(content):
+    return [{'type': 'text', 'text': {'content': content, 'link': None}, 'plain_text': content}]
+
+
+def plain_text(value):
+    return ''.join(part.get('text', {}).get('content', '') for part in value or [])
+
+
+class NotionError(Exception):
+    """An error response in the shape the Notion API sends"""
+
+    def __init__(self, status, code, message):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+class FakeNotion:
+    """In-memory databases and pages behind the fake API.
+
+    Every API request first waits ``latency`` seconds (plus up to ``jitter``
+    more), then fails with a 500 with probability ``error_rate`` or a 429
+    asking for ``retry_after`` seconds with probability ``rate_limited_rate``.
+    ``calls`` counts the requests per endpoint. ``fail_next`` makes the next
+    requests to one endpoint fail with a given error, and ``delay_next``
+    answers them late, after the request has taken effect.
+    """
+
+    def __init__(self, database_id=DATABASE_ID, guide_database_id=GUIDE_DATABASE_ID,
+                 latency=0.0, jitter=0.0, error_rate=0.0, rate_limited_rate=0.0, retry_after=1.0):
+        self.database_id = database_id
+        self.guide_database_id = guide_database_id
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limited_rate = rate_limited_rate
+        self.retry_after = retry_after
+        self.calls = Counter()
+        self.injected = Counter()
+        self.failures = {}
+        self.delays = {}
+        self.databases = {
+            database_id: {'title': 'Scans', 'properties': DATABASE_PROPERTIES},
+            guide_database_id: {'title': 'Guide', 'properties': GUIDE_PROPERTIES},
+        }
+        self.pages = {}
+        self._lock = threading.Lock()
+
+    def record_call(self, endpoint):
+        """Count a request and apply the configured latency and failures to it, returning its answer delay"""
+        with self._lock:
+            self.calls[endpoint] += 1
+            failures = self.failures.get(endpoint)
+            failure = failures.pop(0) if failures else None
+            delays = self.delays.get(endpoint)
+            delay = delays.pop(0) if delays else 0
+        if failure:
+            raise NotionError(*failure)
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+        roll = random.random()
+        if roll < self.rate_limited_rate:
+            with self._lock:
+                self.injected['rate_limited'] += 1
+            raise NotionError(429, 'rate_limited', 'You have been rate limited. Please try again in a few minutes.')
+        if roll < self.rate_limited_rate + self.error_rate:
+            with self._lock:
+                self.injected['internal_server_error'] += 1
+            raise NotionError(500, 'internal_server_error', 'Unexpected error occurred.')
+        return delay
+
+    def fail_next(self, endpoint, status=409, code='conflict_error', message='Conflict occurred while saving.', count=1):
+        """Answer the next ``count`` requests to ``endpoint`` (e.g. ``pages.update``) with an error"""
+        with self._lock:
+            self.failures.setdefault(endpoint, []).extend([(status, code, message)] * count)
+
+    def delay_next(self, endpoint, seconds, count=1):
+        """Answer the next ``count`` requests to ``endpoint`` ``seconds`` late, after carrying them out"""
+        with self._lock:
+            self.delays.setdefault(endpoint, []).extend([seconds] * count)
+
+    def stats(self):
+        """Return the request counters"""
+        with self._lock:
+            return {'calls': dict(self.calls), 'total_calls': sum(self.calls.values()), 'injected': dict(self.injected)}
+
+    def reset_stats(self):
+        with self._lock:
+            self.calls.clear()
+            self.injected.clear()
+
+    def _schema(self, database_id):
+        database = self.databases.get(database_id)
+        if database is None:
+            raise NotionError(404, 'object_not_found', f'Could not find database with ID: {database_id}.')
+        return database['properties']
+
+    def retrieve_database(self, database_id):
+        schema = self._schema(database_id)
+        return {
+            'object': 'database',
+            'id': database_id,
+            'title': rich_text(self.databases[database_id]['title']),
+            'properties': {name: {'id': name, 'name': name, 'type': kind, kind: {}} for name, kind in schema.items()},
+        }
+
+    def _set_properties(self, page, schema, properties):
+        for name, value in properties.items():
+            kind = schema.get(name)
+            if kind is None:
+                raise NotionError(400, 'validation_error', f'{name} is not a property that exists.')
+            if kind not in value:
+                raise NotionError(400, 'validation_error', f'{name} is expected to be {kind}.')
+            if kind in ('title', 'rich_text'):
+                page['properties'][name] = {'id': name, 'type': kind, kind: rich_text(plain_text(value[kind]))}
+            elif kind == 'select':
+                page['properties'][name] = {'id': name, 'type': kind, kind: value[kind] and {'name': value[kind]['name']}}
+            elif kind == 'checkbox':
+                page['properties'][name] = {'id': name, 'type': kind, kind: bool(value[kind])}
+
+    def create_page(self, body):
+        database_id = body.get('parent', {}).get('database_id')
+        schema = self._schema(database_id)
+        now = timestamp()
+        page = {
+            'object': 'page',
+            'id': str(uuid.uuid4()),
+            'created_time': now,
+            'last_edited_time': now,
+            'archived': False,
+            'parent': {'type': 'database_id', 'database_id': database_id},
+            'properties': {name: {'id': name, 'type': kind, kind: {'select': None, 'checkbox': False}.get(kind, [])}
+                           for name, kind in schema.items()},
+        }
+        self._set_properties(page, schema, body.get('properties', {}))
+        with self._lock:
+            self.pages[page['id']] = page
+        return page
+
+    def _page(self, page_id):
+        page = self.pages.get(page_id)
+        if page is None:
+            raise NotionError(404, 'object_not_found', f'Could not find page with ID: {page_id}.')
+        return page
+
+    def retrieve_page(self, page_id):
+        return self._page(page_id)
+
+    def update_page(self, page_id, body):
+        with self._lock:
+            page = self._page(page_id)
+            self._set_properties(page, self._schema(page['parent']['database_id']), body.get('properties', {}))
+            if 'archived' in body:
+                page['archived'] = bool(body['archived'])
+            page['last_edited_time'] = timestamp()
+            return page
+
+    def _matches(self, page, condition):
+        if 'and' in condition:
+            return all(self._matches(page, part) for part in condition['and'])
+        if 'or' in condition:
+            return any(self._matches(page, part) for part in condition['or'])
+        if condition.get('timestamp') in ('last_edited_time', 'created_time'):
+            field = condition['timestamp']
+            value = page[field]
+            check = condition[field]
+            if 'on_or_after' in check:
+                return value >= check['on_or_after']
+            if 'after' in check:
+                return value > check['after']
+            return True
+        prop = page['properties'].get(condition.get('property'), {})
+        for kind in ('title', 'rich_text'):
+            if kind in condition and 'equals' in condition[kind]:
+                return plain_text(prop.get(kind)) == condition[kind]['equals']
+        if 'select' in condition and 'equals' in condition['select']:
+            return (prop.get('select') or {}).get('name') == condition['select']['equals']
+        raise NotionError(400, 'validation_error', f'Unsupported filter: {json.dumps(condition)}')
+
+    def query_database(self, database_id, body):
+        self._schema(database_id)
+        with self._lock:
+            pages = [page for page in self.pages.values()
+                     if page['parent']['database_id'] == database_id and not page['archived']]
+        if body.get('filter'):
+            pages = [page for page in pages if self._matches(page, body['filter'])]
+        pages.sort(key=lambda page: page['created_time'], reverse=True)
+
+        start = int(body.get('start_cursor') or 0)
+        size = min(int(body.get('page_size') or 100), 100)
+        results = pages[start:start + size]
+        has_more = start + size < len(pages)
+        return {
+            'object': 'list',
+            'results': results,
+            'has_more': has_more,
+            'next_cursor': str(start + size) if has_more else None,
+        }
+
+    def add_guide_entry(self, mastercode, route, match=None, check_digit=False):
+        """Add a mastercode (or a prefix, range or regex rule) and its route to the Guide database"""
+        return self.create_page({
+            'parent': {'database_id': self.guide_database_id},
+            'properties': {
+                'Mastercode': {'title': rich_text(mastercode)},
+                'Route': {'rich_text': rich_text(route)},
+                'Match': {'select': {'name': match} if match else None},
+                'Check Digit': {'checkbox': check_digit},
+            },
+        })
+
+
+# (method, path pattern, endpoint name used in the call counters, action)
+ROUTES = [
+    ('POST', re.compile(r'^/v1/databases/([^/]+)/query$'), 'databases.query',
+     lambda api, body, database_id: api.query_database(database_id, body)),
+    ('GET', re.compile(r'^/v1/databases/([^/]+)$'), 'databases.retrieve',
+     lambda api, body, database_id: api.retrieve_database(database_id)),
+    ('POST', re.compile(r'^/v1/pages$'), 'pages.create',
+     lambda api, body: api.create_page(body)),
+    ('GET', re.compile(r'^/v1/pages/([^/]+)$'), 'pages.retrieve',
+     lambda api, body, page_id: api.retrieve_page(page_id)),
+    ('PATCH', re.compile(r'^/v1/pages/([^/]+)$'), 'pages.update',
+     lambda api, body, page_id: api.update_page(page_id, body)),
+]
+
+
+class FakeNotionHandler(BaseHTTPRequestHandler):
+    """Routes HTTP requests to the server's FakeNotion"""
+
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        try:
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out while the injected latency ran
+            self.close_connection = True
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _handle(self, method):
+        api = self.server.api
+        url = urlparse(self.path)
+        try:
+            body = self._body()
+            if url.path == '/_fake/guide' and method == 'POST':
+                return self._send(200, api.add_guide_entry(body['mastercode'], body['route'], body.get('match'),
+                                                           bool(body.get('check_digit'))))
+            if url.path == '/_fake/pages' and method == 'GET':
+                database_id = parse_qs(url.query).get('database_id', [api.database_id])[0]
+                return self._send(200, [page for page in api.pages.values()
+                                        if page['parent']['database_id'] == database_id])
+            if url.path == '/_fake/stats' and method == 'GET':
+                return self._send(200, api.stats())
+            if url.path == '/_fake/stats' and method == 'DELETE':
+                api.reset_stats()
+                return self._send(200, {})
+
+            if not self.headers.get('Authorization', '').startswith('Bearer '):
+                raise NotionError(401, 'unauthorized', 'API token is invalid.')
+            for route_method, pattern, endpoint, action in ROUTES:
+                match = pattern.match(url.path)
+                if match and route_method == method:
+                    delay = api.record_call(endpoint)
+                    result = action(api, body, *match.groups())
+                    if delay:
+                        # The request took effect, but its answer may come after the client gave up
+                        time.sleep(delay)
+                    return self._send(200, result)
+            raise NotionError(400, 'invalid_request_url', 'Invalid request URL.')
+        except NotionError as e:
+            headers = {'Retry-After': f'{api.retry_after:g}'} if e.status == 429 else None
+            self._send(e.status, {'object': 'error', 'status': e.status, 'code': e.code, 'message': e.message}, headers)
+        except (ValueError, KeyError) as e:
+            self._send(400, {'object': 'error', 'status': 400, 'code': 'invalid_json', 'message': str(e)})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+def start_fake_notion(port=0, host='127.0.0.1', api=None):
+    """Serve a FakeNotion on a daemon thread and return the server (its URL is ``server.url``)"""
+    server = ThreadingHTTPServer((host, port), FakeNotionHandler)
+    server.daemon_threads = True
+    server.api = api or FakeNotion()
+    server.url = f'http://{host}:{server.server_address[1]}'
+    threading.Thread(target=server.serve_forever, name='fake-notion', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Notion API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--guide', action='append', default=[], metavar='MASTERCODE=ROUTE',
+                        help='add a Guide database entry (repeatable)')
+    parser.add_argument('--rule', action='append', default=[], metavar='MATCH:PATTERN=ROUTE',
+                        help='add a prefix, range or regex Guide rule, e.g. range:R1000..R1999=Dock-B (repeatable)')
+    parser.add_argument('--latency-ms', type=float, default=0, help='delay added to every API request')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='random extra delay of up to this much')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests answered with a 500')
+    parser.add_argument('--rate-limited-rate', type=float, default=0, help='fraction of requests answered with a 429')
+    parser.add_argument('--retry-after', type=float, default=1, help='Retry-After seconds sent with a 429')
+    args = parser.parse_args()
+
+    api = FakeNotion(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, error_rate=args.error_rate,
+                     rate_limited_rate=args.rate_limited_rate, retry_after=args.retry_after)
+    for entry in args.guide:
+        mastercode, _, route = entry.partition('=')
+        api.add_guide_entry(mastercode, route)
+    for entry in args.rule:
+        rule, _, route = entry.rpartition('=')
+        match, _, pattern = rule.partition(':')
+        api.add_guide_entry(pattern, route, match)
+
+    server = ThreadingHTTPServer((args.host, args.port), FakeNotionHandler)
+    server.daemon_threads = True
+    server.api = api
+    print(f"🧪 Fake Notion API on http://{args.host}:{args.port}")
+    print(f"   NOTION_BASE_URL=http://{args.host}:{args.port}")
+    print(f"   NOTION_DATABASE_ID={api.database_id}")
+    print(f"   NOTION_GUIDE_DATABASE_ID={api.guide_database_id}")
+    print("   NOTION_BARCODE_PROPERTIES=Barcode")
+    print("   NOTION_SCAN_ID_PROPERTY=Scan ID")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+In-memory mastercode index for the Guide database
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from mastercode_rules import EXACT, RuleSet, match_type
+
+logger = logging.getLogger(__name__)
+
+
+def extract_title(page, title_property):
+    """Return the plain text of a page's title property"""
+    title_data = page.get('properties', {}).get(title_property, {})
+    if title_data.get('type') != 'title':
+        return None
+    return ''.join(part.get('plain_text') or part.get('text', {}).get('content', '') for part in title_data['title'])
+
+
+def extract_route(page, route_property):
+    """Return the route stored on a Guide database page"""
+    route_property_data = page.get('properties', {}).get(route_property, {})
+
+    if route_property_data.get('type') == 'rich_text' and route_property_data['rich_text']:
+        return route_property_data['rich_text'][0]['text']['content']
+    elif route_property_data.get('type') == 'title' and route_property_data['title']:
+        return route_property_data['title'][0]['text']['content']
+    else:
+        return "Route not found"
+
+
+def extract_match(page, match_property):
+    """Return a Guide page's match type (select or text property), exact when it has none"""
+    match_data = page.get('properties', {}).get(match_property, {})
+    if match_data.get('type') == 'select':
+        return match_type((match_data['select'] or {}).get('name'))
+    if match_data.get('type') == 'rich_text':
+        return match_type(''.join(part.get('plain_text', '') for part in match_data['rich_text']))
+    return EXACT
+
+
+def extract_checkbox(page, checkbox_property):
+    """Return whether a page's checkbox property is ticked"""
+    checkbox_data = page.get('properties', {}).get(checkbox_property, {})
+    return checkbox_data.get('type') == 'checkbox' and bool(checkbox_data['checkbox'])
+
+
+def iter_database_pages(client, database_id, **query):
+    """Yield every page of a database query, following pagination cursors"""
+    cursor = None
+    while True:
+        if cursor:
+            query['start_cursor'] = cursor
+        response = client.databases.query(database_id=database_id, page_size=100, **query)
+        for page in response['results']:
+            yield page
+        if not response.get('has_more'):
+            break
+        cursor = response.get('next_cursor')
+
+
+class GuideIndex:
+    """Mastercode -> route map of the Guide database, kept fresh in the background.
+
+    A Guide page is an exact mastercode unless its ``match_property`` says
+    ``prefix``, ``range`` (``low..high``) or ``regex``; those pages are compiled
+    into a RuleSet (see mastercode_rules.py) that is consulted when no exact
+    mastercode matches, and recompiled and swapped in whenever they change.
+
+    The full database is paginated once by ``build``; afterwards ``refresh``
+    only asks Notion for pages whose ``last_edited_time`` is at or after the
+    newest edit already seen. Archived pages never show up in a query, so a full
+    rebuild is still done every ``full_rebuild_every`` refreshes to drop them.
+
+    With a ``cache_path`` the index is also saved to disk after every change
+    and loaded from there on start, so mastercodes resolve straight away (and
+    while Notion is unreachable) and the first refresh is incremental.
+    """
+
+    def __init__(self, client, guide_database_id, mastercode_property='Mastercode', route_property='Route',
+                 refresh_interval=60, full_rebuild_every=30, cache_path=None,
+                 match_property='Match', check_digit_property='Check Digit'):
+        self.client = client
+        self.guide_database_id = guide_database_id
+        self.mastercode_property = mastercode_property
+        self.route_property = route_property
+        self.match_property = match_property
+        self.check_digit_property = check_digit_property
+        self.refresh_interval = refresh_interval
+        self.full_rebuild_every = full_rebuild_every
+        self.cache_path = cache_path
+
+        self._routes = {}
+        self._page_codes = {}
+        self._page_rules = {}
+        self._rules = RuleSet()
+        self._last_edited_time = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_refresh = None
+        self.last_error = None
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def __len__(self):
+        return len(self._routes) + len(self._rules)
+
+    @property
+    def rules(self):
+        return self._rules
+
+    def lookup(self, mastercode):
+        """Return (is_mastercode, route) without contacting Notion"""
+        route = self._routes.get(mastercode)
+        if route is None:
+            route = self._rules.lookup(mastercode)
+            if route is None:
+                return False, None
+        return True, route
+
+    def _page_rule(self, page):
+        """Return a Guide page as a (match, pattern, route, check_digit) rule, or None"""
+        pattern = extract_title(page, self.mastercode_property)
+        if not pattern:
+            return None
+        return [
+            extract_match(page, self.match_property),
+            pattern,
+            extract_route(page, self.route_property),
+            extract_checkbox(page, self.check_digit_property)
+        ]
+
+    def build(self):
+        """Paginate the whole Guide database and replace the index"""
+        routes = {}
+        page_codes = {}
+        page_rules = {}
+        last_edited_time = None
+        for page in iter_database_pages(self.client, self.guide_database_id):
+            rule = self._page_rule(page)
+            if rule and rule[0] == EXACT:
+                routes[rule[1]] = rule[2]
+                page_codes[page['id']] = rule[1]
+            elif rule:
+                page_rules[page['id']] = rule
+            last_edited_time = max(last_edited_time or '', page.get('last_edited_time', ''))
+        rules = RuleSet(page_rules.values())
+
+        with self._lock:
+            self._routes = routes
+            self._page_codes = page_codes
+            self._page_rules = page_rules
+            self._rules = rules
+            self._last_edited_time = last_edited_time or None
+        self.last_refresh = time.time()
+        self._ready.set()
+        self.save()
+        logger.info("Guide index built", extra={'mastercodes': len(routes), 'rules': len(rules)})
+
+    def refresh(self):
+        """Fetch pages edited since the last build/refresh and merge them in"""
+        if self._last_edited_time is None:
+            return self.build()
+
+        changed_pages = list(iter_database_pages(
+            self.client,
+            self.guide_database_id,
+            filter={
+                "timestamp": "last_edited_time",
+                "last_edited_time": {"on_or_after": self._last_edited_time}
+            }
+        ))
+
+        if changed_pages:
+            with self._lock:
+                # Copy-on-write so concurrent lookups never see a half-applied refresh
+                routes = dict(self._routes)
+                page_rules = None
+                for page in changed_pages:
+                    rule = self._page_rule(page)
+                    previous = self._page_codes.pop(page['id'], None)
+                    if previous:
+                        routes.pop(previous, None)
+                    if page['id'] in self._page_rules or (rule and rule[0] != EXACT):
+                        if page_rules is None:
+                            page_rules = dict(self._page_rules)
+                        page_rules.pop(page['id'], None)
+                    if rule and rule[0] == EXACT:
+                        routes[rule[1]] = rule[2]
+                        self._page_codes[page['id']] = rule[1]
+                    elif rule:
+                        page_rules[page['id']] = rule
+                    self._last_edited_time = max(self._last_edited_time, page.get('last_edited_time', ''))
+                self._routes = routes
+                if page_rules is not None:
+                    # Only recompiled when a rule changed, lookups keep using the old set until it is swapped in
+                    self._rules = RuleSet(page_rules.values())
+                    self._page_rules = page_rules
+            self.save()
+
+        self.last_refresh = time.time()
+        if changed_pages:
+            logger.info("Guide index refreshed", extra={'changed_pages': len(changed_pages)})
+
+    def _cache_key(self):
+        return [self.guide_database_id, self.mastercode_property, self.route_property,
+                self.match_property, self.check_digit_property]
+
+    def save(self):
+        """Write the index to ``cache_path``"""
+        if not self.cache_path:
+            return
+        with self._lock:
+            snapshot = {
+                'key': self._cache_key(),
+                'routes': self._routes,
+                'page_codes': self._page_codes,
+                'page_rules': self._page_rules,
+                'last_edited_time': self._last_edited_time,
+            }
+        try:
+            temp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            logger.error("Error saving Guide index cache", extra={'error': str(e)})
+
+    def load(self):
+        """Load the index saved by a previous run, returning whether it could be used"""
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return False
+        try:
+            with open(self.cache_path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error("Error loading Guide index cache", extra={'error': str(e)})
+            return False
+        if snapshot.get('key') != self._cache_key():
+            # Cached for a different Guide database or property names
+            return False
+
+        rules = RuleSet(snapshot['page_rules'].values())
+        with self._lock:
+            self._routes = snapshot['routes']
+            self._page_codes = snapshot['page_codes']
+            self._page_rules = snapshot['page_rules']
+            self._rules = rules
+            self._last_edited_time = snapshot['last_edited_time']
+        self._ready.set()
+        logger.info("Guide index loaded from cache", extra={'mastercodes': len(self._routes), 'rules': len(rules)})
+        return True
+
+    def _run(self):
+        refreshes = 0
+        while not self._stop.is_set():
+            try:
+                if not self.ready or refreshes >= self.full_rebuild_every:
+                    self.build()
+                    refreshes = 0
+                else:
+                    self.refresh()
+                    refreshes += 1
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error("Error refreshing Guide index", extra={'error': str(e)})
+            self._stop.wait(self.refresh_interval)
+
+    def start(self):
+        """Build the index and keep refreshing it on a daemon thread"""
+        if self._thread is None:
+            self.load()
+            self._thread = threading.Thread(target=self._run, name='guide-index', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
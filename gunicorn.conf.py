@@ -0,0 +1,26 @@
+"""
+Gunicorn settings for running the web app with several worker processes
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5001')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2, 4)))
+threads = int(os.environ.get('NOTION_SERVER_THREADS', '8'))
+worker_class = 'gthread'
+# Notion calls can be slow under rate limiting, don't kill workers waiting on them
+timeout = 120
+
+# Every worker paces its own Notion requests, so each gets a share of the rate limit
+os.environ['NOTION_WORKER_PROCESSES'] = str(workers)
+
+if workers > 1:
+    # Each worker is a separate process, so per-station state has to live outside of them
+    os.environ.setdefault('NOTION_STATION_BACKEND', 'sqlite')
+
+
+def post_worker_init(worker):
+    """Start the app's background threads inside each forked worker"""
+    from app import start_background_services
+    start_background_services()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Idempotency cache that answers repeated /store requests without contacting Notion
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class _InFlight:
+    """A request being handled for a key; duplicates arriving meanwhile wait for its response"""
+
+    def __init__(self):
+        self.response = None
+        self.done = threading.Event()
+
+
+class IdempotencyCache:
+    """Bounded LRU of successful responses by idempotency key, each kept for ``ttl`` seconds.
+
+    ``begin`` either returns the response already stored for a key or makes
+    the caller its owner; a duplicate arriving while the owner is still
+    working waits (up to ``wait_timeout``) for its response. The owner must
+    call ``complete`` with the response to store, or None if it failed so a
+    retry is handled afresh.
+
+    With a ``path`` responses are also written to a SQLite file, so they
+    survive a restart and are shared by worker processes using the same file.
+    """
+
+    def __init__(self, max_entries=10000, ttl=600, path=None, wait_timeout=30):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.wait_timeout = wait_timeout
+
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key, now, max_age):
+        entry = self._entries.get(key)
+        if entry is None and self._conn is not None:
+            row = self._conn.execute("SELECT response, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row:
+                entry = (json.loads(row[0]), row[1])
+        if entry is None or now - entry[1] > max_age:
+            return None
+        self._remember(key, entry)
+        return entry[0]
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key, max_age=None):
+        """Return the response stored for a key within ``max_age`` seconds, or None"""
+        max_age = self.ttl if max_age is None else min(max_age, self.ttl)
+        with self._lock:
+            response = self._get(key, time.time(), max_age)
+            if response is not None:
+                self.hits += 1
+            return response
+
+    def begin(self, key, max_age=None):
+        """Return ``(response, owner)`` for a key.
+
+        ``response`` is the stored response when the key was seen within
+        ``max_age`` seconds (default: ``ttl``), otherwise None; ``owner`` is
+        True when the caller must handle the request and ``complete`` it.
+        ``(None, False)`` means handle the request without storing its response.
+        """
+        max_age = self.ttl if max_age is None else min(max_age, self.ttl)
+        with self._lock:
+            response = self._get(key, time.time(), max_age)
+            if response is not None:
+                self.hits += 1
+                return response, False
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                self.misses += 1
+                self._in_flight[key] = _InFlight()
+                return None, True
+        # The same request is being handled right now, answer with its outcome.
+        # If it failed (or takes too long) the caller handles its request itself.
+        if not in_flight.done.wait(self.wait_timeout) or in_flight.response is None:
+            return None, False
+        self.hits += 1
+        return in_flight.response, False
+
+    def complete(self, key, response):
+        """Store the owner's response (None when the request failed) and release waiting duplicates"""
+        now = time.time()
+        with self._lock:
+            in_flight = self._in_flight.pop(key, None)
+            if response is not None:
+                self._remember(key, (response, now))
+                if self._conn is not None:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO responses (key, response, stored_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(response), now)
+                    )
+                    self._writes += 1
+                    if self._writes % 1000 == 0:
+                        self._conn.execute("DELETE FROM responses WHERE stored_at < ?", (now - self.ttl,))
+        if in_flight is not None:
+            in_flight.response = response
+            in_flight.done.set()
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+Load and soak test of /store with simulated scanner stations
+
+Each station scans an item every --interval seconds (with some jitter), and
+--mastercode-ratio of the time follows it with a mastercode, like a person
+at a scanner. Every --stations level runs for --duration seconds, so the
+report shows how many stations one instance keeps up with before latency or
+errors degrade:
+
+    python loadtest.py --stations 5,10,20,40 --duration 120
+
+A single level run for hours is a soak test; the memory and thread samples
+then show whether the app leaks:
+
+    python loadtest.py --stations 20 --duration 10800 --sample-seconds 300
+
+By default the app runs in this process against fake_notion.py, started as a
+separate process. --url tests an app that is already running instead; with
+--notion-url pointing at the fake_notion.py it uses, the stored entries are
+still checked. Afterwards every item's entry is checked for the route of its
+mastercode (the pairing check), and the exit code is non-zero if any is wrong.
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+import httpx
+
+from bench import MASTERCODES, configure_environment, percentile, start_app
+
+# Route expected for an item whose mastercode scan failed: it may or may not have been applied
+UNVERIFIED = object()
+
+
+class LatencySample:
+    """Fixed-size random sample of latencies (reservoir sampling), so hours of scans take constant memory"""
+
+    def __init__(self, size=10000, rng=None):
+        self.size = size
+        self.count = 0
+        self.values = []
+        self._rng = rng or random.Random()
+
+    def add(self, value):
+        self.count += 1
+        if len(self.values) < self.size:
+            self.values.append(value)
+        else:
+            index = self._rng.randrange(self.count)
+            if index < self.size:
+                self.values[index] = value
+
+
+class Recorder:
+    """Outcome of every scan the stations send, shared by their threads.
+
+    Latencies are kept per sampling window and as a bounded sample per
+    level. What each item's entry should end up with is appended to
+    ``expectations_path`` rather than kept in memory, so a long soak doesn't
+    grow this process.
+    """
+
+    def __init__(self, expectations_path):
+        self.expectations_path = expectations_path
+        self._expectations = open(expectations_path, 'w')
+        self._lock = threading.Lock()
+        self.reset_level()
+
+    def reset_level(self):
+        with self._lock:
+            self.level = LatencySample()
+            self.level_errors = 0
+            self.window = []
+            self.window_errors = 0
+            self.error_samples = []
+
+    def send(self, client, station, message):
+        """POST one scan to /store, returning whether it succeeded"""
+        started = time.perf_counter()
+        try:
+            response = client.post('/store', json={'message': message, 'station': station})
+            result = response.json()
+            error = None if result.get('success') else result.get('error') or f'HTTP {response.status_code}'
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        with self._lock:
+            self.level.add(elapsed_ms)
+            self.window.append(elapsed_ms)
+            if error:
+                self.level_errors += 1
+                self.window_errors += 1
+                if len(self.error_samples) < 5:
+                    self.error_samples.append(error)
+        return error is None
+
+    def expect(self, item, route):
+        """Record the route an item's entry should end up with (None for no route)"""
+        line = json.dumps([item, None if route is UNVERIFIED else route, route is not UNVERIFIED])
+        with self._lock:
+            self._expectations.write(line + '\n')
+
+    def take_window(self):
+        """Return and reset the latencies and error count since the last call"""
+        with self._lock:
+            window, errors = self.window, self.window_errors
+            self.window, self.window_errors = [], 0
+        return window, errors
+
+    def close(self):
+        with self._lock:
+            self._expectations.close()
+
+
+def drive_station(base_url, station, args, stop, recorder, rng):
+    """Scan like one station until ``stop`` is set"""
+    mastercodes = list(MASTERCODES)
+    with httpx.Client(base_url=base_url, timeout=args.timeout) as client:
+        # Spread the stations' first scans over one interval
+        next_at = time.monotonic() + rng.uniform(0, args.interval)
+        sequence = 0
+        while not stop.is_set():
+            if stop.wait(max(0.0, next_at - time.monotonic())):
+                break
+            item = f'LT-{station}-{sequence}'
+            sequence += 1
+            if recorder.send(client, station, item):
+                route = None
+                if rng.random() < args.mastercode_ratio:
+                    # Finish the pair even if the level ends meanwhile, so the check stays exact
+                    time.sleep(args.pair_delay * rng.uniform(0.5, 1.5))
+                    mastercode = rng.choice(mastercodes)
+                    route = MASTERCODES[mastercode] if recorder.send(client, station, mastercode) else UNVERIFIED
+                recorder.expect(item, route)
+            # A station that fell behind carries on from now rather than sending a burst
+            next_at = max(next_at + args.interval * rng.uniform(0.75, 1.25), time.monotonic())
+
+
+def app_health(base_url):
+    """GET /health of the app under test, or None if it can't be read"""
+    try:
+        return httpx.get(f'{base_url}/health', timeout=10).json()
+    except (httpx.HTTPError, ValueError):
+        return None
+
+
+def take_sample(base_url, recorder, started, stations):
+    """Summarise the window since the last sample, with the app's memory and threads"""
+    window, errors = recorder.take_window()
+    seconds = time.monotonic() - started[0]
+    started[0] = time.monotonic()
+    process = (app_health(base_url) or {}).get('process') or {}
+    rss = process.get('rss_bytes')
+    return {
+        'at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'stations': stations,
+        'scans': len(window),
+        'errors': errors,
+        'scans_per_second': round(len(window) / seconds, 2) if seconds else None,
+        'p50_ms': round(percentile(window, 50), 2) if window else None,
+        'p95_ms': round(percentile(window, 95), 2) if window else None,
+        'rss_mb': round(rss / 2 ** 20, 1) if rss else None,
+        'threads': process.get('threads'),
+    }
+
+
+def run_level(base_url, stations, args, recorder, run_id, samples):
+    """Run ``stations`` stations for --duration seconds and summarise how the app kept up"""
+    recorder.reset_level()
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=drive_station, name=f'station-{index}', daemon=True,
+                         args=(base_url, f'{run_id}-n{stations}-s{index}', args, stop, recorder,
+                               random.Random(f'{args.seed}-{stations}-{index}')))
+        for index in range(stations)
+    ]
+    started = time.monotonic()
+    window_started = [started]
+    for thread in threads:
+        thread.start()
+
+    deadline = started + args.duration
+    while time.monotonic() < deadline:
+        time.sleep(min(args.sample_seconds, max(0.0, deadline - time.monotonic())))
+        sample = take_sample(base_url, recorder, window_started, stations)
+        samples.append(sample)
+        print(f"  {stations} stations: {sample['scans_per_second']} scans/s, p95 {sample['p95_ms']}ms, "
+              f"{sample['errors']} errors, {sample['rss_mb']} MB, {sample['threads']} threads", file=sys.stderr)
+    stop.set()
+    for thread in threads:
+        thread.join(args.timeout + args.pair_delay * 2)
+    seconds = time.monotonic() - started
+
+    scans = recorder.level.count
+    offered = stations * (1 + args.mastercode_ratio) / args.interval
+    achieved = scans / seconds
+    error_rate = recorder.level_errors / scans if scans else 0.0
+    p95 = percentile(recorder.level.values, 95)
+    degraded = []
+    if p95 is not None and p95 > args.max_p95_ms:
+        degraded.append(f'p95 {p95:.0f}ms > {args.max_p95_ms:g}ms')
+    if error_rate > args.max_error_rate:
+        degraded.append(f'error rate {error_rate:.2%} > {args.max_error_rate:.2%}')
+    if achieved < offered * 0.9:
+        degraded.append(f'{achieved:.1f} of {offered:.1f} scans/s sent')
+    return {
+        'stations': stations,
+        'seconds': round(seconds, 1),
+        'scans': scans,
+        'errors': recorder.level_errors,
+        'error_rate': round(error_rate, 4),
+        'sample_errors': recorder.error_samples,
+        'offered_scans_per_second': round(offered, 2),
+        'scans_per_second': round(achieved, 2),
+        'p50_ms': round(percentile(recorder.level.values, 50), 2) if scans else None,
+        'p95_ms': round(p95, 2) if p95 is not None else None,
+        'p99_ms': round(percentile(recorder.level.values, 99), 2) if scans else None,
+        'degraded': degraded,
+    }
+
+
+def wait_for_drain(base_url, timeout):
+    """Wait until the app's write-behind or offline journal has sent everything"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        queue = (app_health(base_url) or {}).get('queue')
+        if not queue or not (queue['counts'].get('pending') or queue['counts'].get('sending')):
+            return True
+        time.sleep(0.5)
+    return False
+
+
+def check_pairing(expectations_path, pages):
+    """Compare every item's entry with the route its mastercode should have given it"""
+    routes = {}
+    for page in pages:
+        properties = page.get('properties', {})
+        message = ''.join(part.get('plain_text', '') for part in properties.get('Message', {}).get('title') or [])
+        routes.setdefault(message, []).append((properties.get('Barcode', {}).get('select') or {}).get('name'))
+
+    result = {'items': 0, 'correct': 0, 'unverified': 0, 'missing': 0, 'duplicated': 0, 'wrong_route': 0,
+              'examples': []}
+    with open(expectations_path) as f:
+        for line in f:
+            item, route, verifiable = json.loads(line)
+            result['items'] += 1
+            found = routes.get(item, [])
+            if not found:
+                problem = 'missing'
+            elif len(found) > 1:
+                problem = 'duplicated'
+            elif not verifiable:
+                result['unverified'] += 1
+                continue
+            elif found[0] != route:
+                problem = 'wrong_route'
+            else:
+                result['correct'] += 1
+                continue
+            result[problem] += 1
+            if len(result['examples']) < 5:
+                result['examples'].append({'item': item, 'problem': problem, 'expected': route, 'found': found})
+    return result
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_notion_process(args):
+    """Run fake_notion.py as its own process, so its stored pages don't count towards the app's memory"""
+    port = free_port()
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_notion.py'),
+               '--port', str(port), '--latency-ms', str(args.latency_ms), '--jitter-ms', str(args.jitter_ms),
+               '--error-rate', str(args.error_rate)]
+    for mastercode, route in MASTERCODES.items():
+        command += ['--guide', f'{mastercode}={route}']
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            httpx.get(f'{url}/_fake/stats', timeout=1)
+            return process, url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError('fake_notion.py did not start')
+
+
+def growth(samples):
+    """Memory and thread growth from the first to the last sample of the last level (the soak)"""
+    measured = [sample for sample in samples
+                if sample['rss_mb'] is not None and sample['stations'] == samples[-1]['stations']]
+    if len(measured) < 2:
+        return None
+    first, last = measured[0], measured[-1]
+    hours = (datetime.fromisoformat(last['at']) - datetime.fromisoformat(first['at'])).total_seconds() / 3600
+    return {
+        'rss_mb_first': first['rss_mb'],
+        'rss_mb_last': last['rss_mb'],
+        'rss_mb_per_hour': round((last['rss_mb'] - first['rss_mb']) / hours, 1) if hours else None,
+        'threads_first': first['threads'],
+        'threads_last': last['threads'],
+    }
+
+
+def print_report(report):
+    print(f"{'stations':>8} {'scans':>7} {'offered/s':>10} {'scans/s':>8} {'errors':>7} {'p50 ms':>9} "
+          f"{'p95 ms':>9} {'p99 ms':>9}  verdict")
+    for level in report['levels']:
+        verdict = 'degraded: ' + ', '.join(level['degraded']) if level['degraded'] else 'ok'
+        print(f"{level['stations']:>8} {level['scans']:>7} {level['offered_scans_per_second']:>10} "
+              f"{level['scans_per_second']:>8} {level['error_rate']:>7.2%} {level['p50_ms']:>9} "
+              f"{level['p95_ms']:>9} {level['p99_ms']:>9}  {verdict}")
+
+    capacity = report['capacity']
+    print()
+    if capacity:
+        print(f"✅ Sustained {capacity['stations']} stations at {capacity['scans_per_second']} scans/s")
+    else:
+        print("❌ Degraded at every level tested")
+
+    if report['growth']:
+        growth = report['growth']
+        print(f"🧠 Memory {growth['rss_mb_first']} -> {growth['rss_mb_last']} MB "
+              f"({growth['rss_mb_per_hour']} MB/hour), threads {growth['threads_first']} -> {growth['threads_last']}")
+
+    pairing = report['pairing']
+    if pairing is None:
+        print("🔗 Pairing not checked (pass --notion-url to check entries stored by fake_notion.py)")
+    else:
+        print(f"🔗 Pairing: {pairing['correct']} of {pairing['items']} items correct, {pairing['unverified']} unverified, "
+              f"{pairing['missing']} missing, {pairing['duplicated']} duplicated, {pairing['wrong_route']} wrong route")
+        for example in pairing['examples']:
+            print(f"  - {example}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load and soak test /store with simulated scanner stations')
+    parser.add_argument('--stations', default='5,10,20',
+                        help='comma-separated numbers of stations, each level run for --duration seconds')
+    parser.add_argument('--duration', type=float, default=60, help='seconds each level runs')
+    parser.add_argument('--interval', type=float, default=2.0, help='average seconds between a station\'s items')
+    parser.add_argument('--mastercode-ratio', type=float, default=0.5,
+                        help='fraction of items followed by a mastercode scan')
+    parser.add_argument('--pair-delay', type=float, default=0.5,
+                        help='average seconds between an item and its mastercode')
+    parser.add_argument('--sample-seconds', type=float, default=10,
+                        help='how often throughput, latency, memory and threads are sampled')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds a station waits for /store')
+    parser.add_argument('--max-p95-ms', type=float, default=1000, help='p95 latency above which a level is degraded')
+    parser.add_argument('--max-error-rate', type=float, default=0.01,
+                        help='fraction of failed scans above which a level is degraded')
+    parser.add_argument('--url', help='test an app that is already running instead of one in this process')
+    parser.add_argument('--notion-url', help='fake_notion.py used by the --url app, for the pairing check')
+    parser.add_argument('--latency-ms', type=float, default=100, help='fake Notion latency per request')
+    parser.add_argument('--jitter-ms', type=float, default=50, help='random extra fake Notion latency')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of Notion requests failing with 500')
+    parser.add_argument('--rate-limit', type=float, default=3, help="the app's NOTION_RATE_LIMIT")
+    parser.add_argument('--write-behind', action='store_true', help='test with NOTION_WRITE_BEHIND on')
+    parser.add_argument('--coalesce-ms', type=float, default=0,
+                        help="the app's NOTION_COALESCE_WINDOW_MS (only used with --write-behind)")
+    parser.add_argument('--server-threads', type=int, default=int(os.getenv('NOTION_SERVER_THREADS', '8')),
+                        help="the app's request threads")
+    parser.add_argument('--drain-timeout', type=float, default=300,
+                        help='seconds to wait for the journal to empty before the pairing check')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the scan mix')
+    parser.add_argument('--output', help='JSON file to write the full report to')
+    args = parser.parse_args()
+
+    levels = [int(value) for value in args.stations.split(',')]
+    run_id = datetime.now(timezone.utc).strftime('%H%M%S')
+    fake_process = None
+    notion_url = args.notion_url
+
+    with tempfile.TemporaryDirectory() as work_dir, open(os.devnull, 'w') as quiet:
+        recorder = Recorder(os.path.join(work_dir, 'expectations.jsonl'))
+        try:
+            if args.url:
+                base_url = args.url.rstrip('/')
+            else:
+                fake_process, notion_url = start_fake_notion_process(args)
+                # The app's own per-scan output would drown the report
+                with redirect_stdout(quiet):
+                    configure_environment(args, notion_url, work_dir)
+                    web_app, server = start_app(threads=args.server_threads)
+                base_url = f'http://127.0.0.1:{server.effective_port}'
+            print(f"🏭 Load testing {base_url}" + (f" against fake Notion at {notion_url}" if notion_url else ''),
+                  file=sys.stderr)
+
+            # Let the app build its Guide index and warm up before measuring
+            for _ in range(200):
+                health = app_health(base_url)
+                if health and (health.get('guide_index') or {}).get('ready', True):
+                    break
+                time.sleep(0.1)
+            with redirect_stdout(quiet):
+                httpx.post(f'{base_url}/store', json={'message': 'warm-up', 'station': f'{run_id}-warm-up'},
+                           timeout=args.timeout)
+
+            samples = []
+            results = [run_level(base_url, stations, args, recorder, run_id, samples) for stations in levels]
+            recorder.close()
+
+            pairing = None
+            if notion_url:
+                if not wait_for_drain(base_url, args.drain_timeout):
+                    print("⚠️  The app's journal did not empty, unsent items count as missing", file=sys.stderr)
+                pages = httpx.get(f'{notion_url}/_fake/pages', timeout=300).json()
+                pairing = check_pairing(recorder.expectations_path, pages)
+        finally:
+            recorder.close()
+            if fake_process:
+                fake_process.terminate()
+
+    sustained = [level for level in results if not level['degraded']]
+    report = {
+        'recorded_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'settings': {name: value for name, value in vars(args).items() if name != 'output'},
+        'levels': results,
+        'capacity': max(sustained, key=lambda level: level['stations']) if sustained else None,
+        'growth': growth(samples),
+        'samples': samples,
+        'pairing': pairing,
+    }
+    print()
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Report written to {args.output}")
+
+    if pairing and (pairing['missing'] or pairing['duplicated'] or pairing['wrong_route']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,7 @@ Notion for DS - A program to store messages in Notion databases
 import os
 import sys
 import json
+import argparse
 from dotenv import load_dotenv
 from notion_client import Client
 
@@ -58,8 +59,159 @@ def store_in_notion_database(client, database_id, message, message_property='Mes
         print(f"❌ Error storing in Notion database: {e}")
         return False
 
+def build_scheduled_client(notion_token):
+    """Notion client that paces every call to stay inside Notion's rate limit, retrying 429s"""
+    from notion_scheduler import RequestScheduler
+    from scheduled_client import ScheduledClient
+    
+    scheduler = RequestScheduler(
+        rate=float(os.getenv('NOTION_RATE_LIMIT', '3')),
+        burst=float(os.getenv('NOTION_RATE_BURST', '3'))
+    )
+    return ScheduledClient(scheduler, auth=notion_token, base_url=os.getenv('NOTION_BASE_URL') or 'https://api.notion.com')
+
+def resolve_properties(notion, database_id, message_property, name_property):
+    """Return the database's title and barcode property names, exiting if the schema can't be read"""
+    from schema_cache import SchemaCache
+    
+    barcode_properties = os.getenv('NOTION_BARCODE_PROPERTIES', 'barcode,Barcode,BARCODE').split(',')
+    schema_cache = SchemaCache()
+    title_property = schema_cache.title_property(notion, database_id, [message_property, name_property])
+    if not title_property:
+        print("Error: could not read the Notion database schema")
+        sys.exit(1)
+    properties = schema_cache.properties(notion, database_id)
+    barcode_property = next((name for name in barcode_properties if name in properties), None)
+    return title_property, barcode_property, properties
+
+def run_batch_command(args):
+    """Bulk-load a JSON Lines or CSV file of scans into Notion"""
+    from batch import iter_scans, run_batch
+    from guide_index import GuideIndex
+    
+    notion_token, database_id, message_property, name_property = load_environment()
+    guide_database_id = os.getenv('NOTION_GUIDE_DATABASE_ID')
+    
+    notion = build_scheduled_client(notion_token)
+    title_property, barcode_property, _ = resolve_properties(notion, database_id, message_property, name_property)
+    
+    # Load the whole Guide database once so rows are matched locally
+    guide_index = None
+    if guide_database_id:
+        guide_index = GuideIndex(
+            notion,
+            guide_database_id,
+            os.getenv('NOTION_MASTERCODE_PROPERTY', 'Mastercode'),
+            os.getenv('NOTION_ROUTE_PROPERTY', 'Route'),
+            match_property=os.getenv('NOTION_MATCH_PROPERTY', 'Match'),
+            check_digit_property=os.getenv('NOTION_CHECK_DIGIT_PROPERTY', 'Check Digit')
+        )
+        guide_index.build()
+    
+    def lookup(message):
+        return guide_index.lookup(message) if guide_index else (False, None)
+    
+    fmt = args.format or ('csv' if args.file.endswith('.csv') else 'jsonl')
+    source = sys.stdin if args.file == '-' else open(args.file, newline='', encoding='utf-8')
+    output = open(args.output, 'w') if args.output else sys.stdout
+    
+    summary = None
+    try:
+        for result in run_batch(iter_scans(source, fmt), notion, database_id, title_property, barcode_property, lookup, args.concurrency):
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            if result.get('summary'):
+                summary = result
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    
+    print(f"✅ {summary['succeeded']} rows stored, ❌ {summary['failed']} failed "
+          f"({summary['entries']} entries in {summary['seconds']}s, {summary['rows_per_second']} rows/s)", file=sys.stderr)
+
+def run_export_command(args):
+    """Sync the main database into a local SQLite snapshot, fetching only pages edited since the last sync"""
+    from snapshot import Snapshot
+    
+    notion_token, database_id, message_property, name_property = load_environment()
+    notion = build_scheduled_client(notion_token)
+    title_property, barcode_property, properties = resolve_properties(notion, database_id, message_property, name_property)
+    scan_id_property = os.getenv('NOTION_SCAN_ID_PROPERTY')
+    if properties.get(scan_id_property, {}).get('type') != 'rich_text':
+        scan_id_property = None
+    
+    snapshot = Snapshot(args.path)
+    try:
+        result = snapshot.sync(notion, database_id, title_property, barcode_property, scan_id_property, full=args.full)
+        pages = snapshot.last_sync(database_id)[2]
+    finally:
+        snapshot.close()
+    
+    print(f"✅ {result['pages']} pages synced, {result['removed']} removed in {result['seconds']}s "
+          f"({pages} entries in {args.path})", file=sys.stderr)
+
+def run_query_command(args):
+    """Answer a question from the local snapshot, one JSON line per result"""
+    from snapshot import Snapshot
+    
+    if not os.path.exists(args.path):
+        print(f"Error: {args.path} not found, run 'python main.py export' first")
+        sys.exit(1)
+    
+    snapshot = Snapshot(args.path)
+    try:
+        if args.query == 'route':
+            if not args.route:
+                print("Error: 'route' needs the route to list entries for")
+                sys.exit(1)
+            results = snapshot.entries_by_route(args.route)
+        elif args.query == 'missing-route':
+            results = snapshot.entries_missing_route()
+        elif args.query == 'barcode-counts':
+            results = ({'barcode': barcode, 'entries': entries} for barcode, entries in snapshot.counts_by_barcode(args.min_count))
+        else:
+            results = ({'route': route, 'entries': entries} for route, entries in snapshot.counts_by_route())
+        for result in results:
+            sys.stdout.write(json.dumps(result) + "\n")
+    finally:
+        snapshot.close()
+
 def main():
     """Main function"""
+    load_dotenv()
+    
+    parser = argparse.ArgumentParser(description="Store messages in Notion databases")
+    subcommands = parser.add_subparsers(dest='command')
+    
+    batch_parser = subcommands.add_parser('batch', help="bulk-load scans from a JSON Lines or CSV file")
+    batch_parser.add_argument('file', help="JSON Lines or CSV file of scans, or - for stdin")
+    batch_parser.add_argument('--format', choices=['jsonl', 'csv'], help="input format (default: from the file extension)")
+    batch_parser.add_argument('--concurrency', type=int, default=int(os.getenv('NOTION_BATCH_CONCURRENCY', '3')),
+                              help="number of concurrent Notion writes (default: 3)")
+    batch_parser.add_argument('--output', help="write per-row results here instead of stdout")
+    
+    snapshot_path = os.getenv('NOTION_SNAPSHOT_PATH', 'notion_snapshot.db')
+    export_parser = subcommands.add_parser('export', help="sync the main database into a local SQLite snapshot")
+    export_parser.add_argument('--path', default=snapshot_path, help=f"snapshot file (default: {snapshot_path})")
+    export_parser.add_argument('--full', action='store_true',
+                               help="re-read every page and drop entries that were archived in Notion")
+    
+    query_parser = subcommands.add_parser('query', help="query the local snapshot written by export")
+    query_parser.add_argument('query', choices=['route', 'missing-route', 'barcode-counts', 'route-counts'],
+                              help="entries with a route, entries without one, or entry counts per barcode or route")
+    query_parser.add_argument('route', nargs='?', help="route to list entries for (with 'route')")
+    query_parser.add_argument('--min-count', type=int, default=1,
+                              help="only barcodes with at least this many entries (with 'barcode-counts')")
+    query_parser.add_argument('--path', default=snapshot_path, help=f"snapshot file (default: {snapshot_path})")
+    
+    args = parser.parse_args()
+    commands = {'batch': run_batch_command, 'export': run_export_command, 'query': run_query_command}
+    if args.command in commands:
+        commands[args.command](args)
+        return
+    
     print("🤖 Welcome to Notion for DS!")
     print("=" * 40)
     
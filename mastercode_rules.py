@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Compiled prefix, range and regex mastercode rules of the Guide database
+"""
+
+import heapq
+import logging
+import re
+from bisect import bisect_right
+
+logger = logging.getLogger(__name__)
+
+# Match types of a Guide page, exact being the default
+EXACT = 'exact'
+PREFIX = 'prefix'
+RANGE = 'range'
+REGEX = 'regex'
+
+# Separator of a range rule's bounds, e.g. "R1000..R1999"
+RANGE_SEPARATOR = '..'
+
+
+def match_type(value):
+    """Normalise a Guide page's match type, a blank one being exact"""
+    return (value or '').strip().lower() or EXACT
+
+
+def code_key(code):
+    """Sort key of a code: shorter codes first, so numeric codes sort by value"""
+    return (len(code), code)
+
+
+def check_digit_valid(code):
+    """Whether a code ends in a valid GS1 mod-10 check digit (EAN, UPC, SSCC...)"""
+    if len(code) < 2 or not code.isdigit():
+        return False
+    total = sum(int(digit) * (3 if position % 2 else 1) for position, digit in enumerate(reversed(code[:-1]), 1))
+    return (10 - total % 10) % 10 == int(code[-1])
+
+
+class RuleSet:
+    """Read-only set of prefix, range and regex rules, compiled for fast lookups.
+
+    Prefixes go into a trie, walked once per code, the longest matching prefix
+    winning. Ranges are flattened into sorted, non-overlapping segments found
+    by bisection (where ranges overlap, the one starting last wins, so a
+    narrower range nested in a wider one takes precedence). Regexes can't be
+    indexed and are tried in turn, so they should stay few.
+
+    A rule is ``(match, pattern, route, check_digit)``; with ``check_digit``
+    it only matches codes whose last digit is a valid check digit. A new
+    RuleSet is compiled for every change and swapped in whole, so a lookup
+    never sees a half-built one.
+    """
+
+    def __init__(self, rules=()):
+        self._trie = {}
+        self._starts = []
+        self._segments = []
+        self._regexes = []
+        self.counts = {PREFIX: 0, RANGE: 0, REGEX: 0, 'invalid': 0}
+
+        ranges = []
+        for rule in rules:
+            match, pattern, route, check_digit = rule
+            try:
+                if match == PREFIX:
+                    self._add_prefix(pattern, (route, check_digit))
+                elif match == RANGE:
+                    low, high = (bound.strip() for bound in pattern.split(RANGE_SEPARATOR, 1))
+                    if not low or not high or code_key(low) > code_key(high):
+                        raise ValueError(f"invalid range {pattern!r}")
+                    ranges.append((code_key(low), code_key(high), route, check_digit))
+                elif match == REGEX:
+                    self._regexes.append((re.compile(pattern), route, check_digit))
+                else:
+                    raise ValueError(f"unknown match type {match!r}")
+                self.counts[match] += 1
+            except (ValueError, re.error) as e:
+                self.counts['invalid'] += 1
+                logger.warning("Skipping invalid Guide rule", extra={'match': match, 'pattern': pattern, 'error': str(e)})
+        self._compile_ranges(ranges)
+
+    def __len__(self):
+        return self.counts[PREFIX] + self.counts[RANGE] + self.counts[REGEX]
+
+    def _add_prefix(self, prefix, value):
+        if not prefix:
+            raise ValueError("empty prefix")
+        node = self._trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        # '' can't be a character, so it marks the end of a prefix
+        node.setdefault('', value)
+
+    def _compile_ranges(self, ranges):
+        # Sweep the range bounds in order, keeping the ranges open at each point in
+        # a heap (latest start first) and closing those that ended on the way
+        bounds = []
+        for index, (low, high, route, check_digit) in enumerate(ranges):
+            bounds.append((low, 0, index))
+            bounds.append((high, 1, index))
+        bounds.sort()
+
+        open_ranges = []
+        closed = set()
+        for key, side, index in bounds:
+            if side == 0:
+                heapq.heappush(open_ranges, ((-key[0], _negated(key[1])), index))
+            else:
+                closed.add(index)
+            while open_ranges and open_ranges[0][1] in closed:
+                heapq.heappop(open_ranges)
+            winner = ranges[open_ranges[0][1]][2:] if open_ranges else None
+            # A segment starts at each bound: at a low bound itself, just after a high one
+            start = (key, side)
+            if self._starts and self._starts[-1] == start:
+                self._segments[-1] = winner
+            else:
+                self._starts.append(start)
+                self._segments.append(winner)
+
+    def _range_lookup(self, code):
+        position = bisect_right(self._starts, (code_key(code), 0)) - 1
+        return self._segments[position] if position >= 0 else None
+
+    def lookup(self, code):
+        """Return the route of the best rule matching a code, or None"""
+        check_digit_ok = None
+
+        def accept(value):
+            nonlocal check_digit_ok
+            if value is None:
+                return False
+            if not value[1]:
+                return True
+            if check_digit_ok is None:
+                check_digit_ok = check_digit_valid(code)
+            return check_digit_ok
+
+        # Longest matching prefix first
+        best = None
+        node = self._trie
+        for char in code:
+            node = node.get(char)
+            if node is None:
+                break
+            if accept(node.get('')):
+                best = node['']
+        if best is not None:
+            return best[0]
+
+        if self._starts:
+            value = self._range_lookup(code)
+            if accept(value):
+                return value[0]
+
+        for regex, route, check_digit in self._regexes:
+            if regex.fullmatch(code) and accept((route, check_digit)):
+                return route
+        return None
+
+
+def _negated(text):
+    """Key sorting strings in reverse order"""
+    return tuple(-ord(char) for char in text)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+In-process metrics and timing spans, exposed in the Prometheus text format
+"""
+
+import bisect
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from a cache hit to a slow, retried Notion call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named family of series keyed by label values"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, label_values):
+        if len(label_values) != len(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}, got {label_values}")
+        return tuple(str(value) for value in label_values)
+
+    def samples(self):
+        """Yield (suffix, label values, extra labels, value) for every series"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, label_values, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labels, label_values, extra)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        key = self._key(label_values)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, *label_values):
+        return self._series.get(self._key(label_values), 0)
+
+    def samples(self):
+        with self._lock:
+            series = sorted(self._series.items())
+        for key, value in series:
+            yield '', key, None, value
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, *label_values):
+        key = self._key(label_values)
+        with self._lock:
+            self._series[key] = value
+
+    def replace(self, values):
+        """Swap in a whole new {label values: value} mapping, dropping series that went away"""
+        series = {self._key(key if isinstance(key, tuple) else (key,)): value for key, value in values.items()}
+        with self._lock:
+            self._series = series
+
+    def samples(self):
+        with self._lock:
+            series = sorted(self._series.items())
+        for key, value in series:
+            yield '', key, None, value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, seconds, *label_values):
+        key = self._key(label_values)
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket (not cumulative) counts, then count and sum
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            series[0][index] += 1
+            series[1] += 1
+            series[2] += seconds
+
+    def samples(self):
+        with self._lock:
+            series = sorted((key, ([*counts], count, total)) for key, (counts, count, total) in self._series.items())
+        for key, (counts, count, total) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                yield '_bucket', key, [('le', _format_value(bound))], cumulative
+            yield '_count', key, None, count
+            yield '_sum', key, None, round(total, 6)
+
+
+class Registry:
+    """The metrics of one process"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+SCANS = REGISTRY.counter(
+    'notionfords_scans_total', 'Scans received by /store, by kind and outcome', ['kind', 'outcome'])
+SCAN_SECONDS = REGISTRY.histogram(
+    'notionfords_scan_duration_seconds', 'Time to answer a /store request', ['kind'])
+STAGE_SECONDS = REGISTRY.histogram(
+    'notionfords_stage_duration_seconds', 'Time spent in each stage of handling a scan', ['stage'])
+NOTION_REQUESTS = REGISTRY.counter(
+    'notionfords_notion_requests_total', 'Notion API requests sent, by endpoint and response status', ['endpoint', 'status'])
+NOTION_REQUEST_SECONDS = REGISTRY.histogram(
+    'notionfords_notion_request_duration_seconds', 'Duration of Notion API requests, retries counted separately',
+    ['endpoint'])
+
+# Live state, set from the running services when /metrics is scraped
+QUEUE_SCANS = REGISTRY.gauge('notionfords_queue_scans', 'Scans in the local journal, by status', ['status'])
+GUIDE_INDEX_MASTERCODES = REGISTRY.gauge('notionfords_guide_index_mastercodes', 'Mastercodes in the Guide index')
+GUIDE_INDEX_RULES = REGISTRY.gauge('notionfords_guide_index_rules', 'Prefix, range and regex rules in the Guide index', ['match'])
+GUIDE_INDEX_AGE = REGISTRY.gauge('notionfords_guide_index_age_seconds', 'Seconds since the Guide index was refreshed')
+SCHEMA_CACHE_DATABASES = REGISTRY.gauge('notionfords_schema_cache_databases', 'Database schemas currently cached')
+STATIONS = REGISTRY.gauge('notionfords_stations', 'Scanner stations with a known last entry')
+IDEMPOTENCY_CACHE = REGISTRY.gauge('notionfords_idempotency_cache', 'Idempotency cache size, hits and misses', ['stat'])
+LIVE_FEED = REGISTRY.gauge('notionfords_live_feed', 'Live feed watchers, events published and events dropped', ['stat'])
+NOTION_ONLINE = REGISTRY.gauge('notionfords_notion_online', 'Whether the last Notion request got an answer')
+SCHEDULER = REGISTRY.gauge('notionfords_scheduler', 'Notion request scheduler counters', ['stat'])
+CIRCUIT_STATE = REGISTRY.gauge('notionfords_circuit_state', 'Notion circuit breaker state (0 closed, 1 half-open, 2 open)')
+CIRCUIT_BREAKER = REGISTRY.gauge('notionfords_circuit_breaker', 'Times the Notion circuit opened and requests it refused', ['stat'])
+PROCESS_RESIDENT_MEMORY = REGISTRY.gauge('notionfords_process_resident_memory_bytes', 'Resident memory of this process')
+PROCESS_THREADS = REGISTRY.gauge('notionfords_process_threads', 'Python threads alive in this process')
+TENANT_NOTION_ONLINE = REGISTRY.gauge(
+    'notionfords_tenant_notion_online', 'Whether the last Notion request of each tenant got an answer', ['tenant'])
+TENANT_CIRCUIT_STATE = REGISTRY.gauge(
+    'notionfords_tenant_circuit_state', 'Notion circuit breaker state of each tenant (0 closed, 1 half-open, 2 open)', ['tenant'])
+TENANT_QUEUE_SCANS = REGISTRY.gauge(
+    'notionfords_tenant_queue_scans', 'Scans in each tenant\'s local journal, by status', ['tenant', 'status'])
+
+
+@contextmanager
+def span(stage):
+    """Time the block as one stage of handling a scan"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage)
+
+
+def notion_endpoint(path, method):
+    """Name a Notion API request by its endpoint, e.g. ``databases.query``, leaving IDs out"""
+    parts = path.strip('/').split('/')
+    resource = parts[0]
+    if len(parts) >= 3:
+        return f'{resource}.{parts[2]}'
+    if len(parts) == 1:
+        return f'{resource}.create' if method.upper() == 'POST' else f'{resource}.list'
+    return f'{resource}.update' if method.upper() == 'PATCH' else f'{resource}.retrieve'
+
+
+def process_stats():
+    """Resident memory and thread count of this process, for spotting leaks in long runs"""
+    rss = None
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+            # Peak rather than current memory, in KB on Linux and bytes on macOS
+            usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            rss = usage if sys.platform == 'darwin' else usage * 1024
+        except ImportError:
+            pass
+    return {'rss_bytes': rss, 'threads': threading.active_count()}
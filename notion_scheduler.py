@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Rate-limited, prioritised scheduling of Notion API requests
+
+The Notion client library is only imported once a request is made, so the
+web app can start serving before it has loaded (see scheduled_client.py for
+the client itself).
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+# Lower numbers are sent first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+
+_local = threading.local()
+
+
+@contextmanager
+def request_priority(priority):
+    """Send the Notion requests made inside this block with the given priority"""
+    previous = getattr(_local, 'priority', PRIORITY_NORMAL)
+    _local.priority = priority
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+def current_priority():
+    return getattr(_local, 'priority', PRIORITY_NORMAL)
+
+
+class RequestScheduler:
+    """Token bucket shared by every request made with one Notion integration.
+
+    Callers wait in priority order (then arrival order) for a token. A 429
+    pauses the whole bucket for the ``Retry-After`` the API asked for and halves
+    the sending rate, which then creeps back up to ``rate`` as requests succeed.
+    Transient failures are retried with jittered exponential backoff.
+
+    ``online`` turns False when Notion can't be reached (network errors,
+    timeouts, 5xx once retries run out) and True again after any successful
+    request. While offline, network errors fail fast instead of being retried.
+
+    Every attempt is also reported to ``breaker``, which refuses requests
+    outright (CircuitOpenError) while Notion keeps failing, so callers don't
+    each wait out a timeout. Attempts time out after ``write_timeout``
+    seconds for page creates and updates and ``read_timeout`` for the rest.
+    """
+
+    def __init__(self, rate=3.0, burst=3, max_retries=5, base_delay=0.5, max_delay=30.0, read_timeout=15.0,
+                 write_timeout=8.0, breaker=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.read_timeout = read_timeout
+        self.write_timeout = write_timeout
+        self.breaker = breaker or CircuitBreaker()
+
+        self._current_rate = rate
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+        self.online = True
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.throttled_seconds = 0.0
+        self.max_queue_depth = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self._current_rate)
+        self._refilled_at = now
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        """Block until this caller may send a request"""
+        started = time.monotonic()
+        with self._cond:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            self.max_queue_depth = max(self.max_queue_depth, len(self._waiting))
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self._waiting[0] == ticket:
+                    delay = max(self._paused_until - now, (1 - self._tokens) / self._current_rate)
+                    if delay <= 0:
+                        heapq.heappop(self._waiting)
+                        self._tokens -= 1
+                        self.requests += 1
+                        self.throttled_seconds += now - started
+                        self._cond.notify_all()
+                        return
+                    self._cond.wait(delay)
+                else:
+                    self._cond.wait()
+
+    def _throttle(self, retry_after):
+        with self._cond:
+            self.rate_limited += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self._current_rate = max(self.rate / 8, self._current_rate / 2)
+            self._cond.notify_all()
+
+    def _recover(self):
+        if self._current_rate < self.rate:
+            with self._cond:
+                self._current_rate = min(self.rate, self._current_rate + self.rate / 20)
+
+    def timeout(self, endpoint):
+        """Seconds an attempt at a request to ``endpoint`` (e.g. ``pages.create``) may take"""
+        return self.write_timeout if endpoint in ('pages.create', 'pages.update') else self.read_timeout
+
+    def _backoff(self, attempt):
+        # Full jitter keeps retrying callers from moving in lockstep
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def call(self, function, *args, priority=None, idempotent=True, **kwargs):
+        """Run ``function`` once a token is available, retrying rate limits and transient errors.
+
+        Server errors and timeouts are only retried for ``idempotent`` calls,
+        since a create that timed out may still have created the page.
+        """
+        import httpx
+        from notion_client.errors import HTTPResponseError, RequestTimeoutError
+
+        if priority is None:
+            priority = current_priority()
+
+        attempt = 0
+        while True:
+            try:
+                self.breaker.allow()
+            except CircuitOpenError:
+                self.online = False
+                raise
+            self.acquire(priority)
+            try:
+                result = function(*args, **kwargs)
+            except HTTPResponseError as e:
+                if e.status >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if e.status >= 500 and attempt >= self.max_retries:
+                    # Still failing after every retry, treat Notion as down
+                    self.online = False
+                if attempt >= self.max_retries or not (e.status == 429 or (e.status >= 500 and idempotent)):
+                    raise
+                if e.status == 429:
+                    try:
+                        retry_after = float(e.headers.get('Retry-After', ''))
+                    except ValueError:
+                        retry_after = self._backoff(attempt)
+                    self._throttle(retry_after + random.uniform(0, self.base_delay))
+                else:
+                    time.sleep(self._backoff(attempt))
+            except httpx.ConnectError:
+                self.breaker.record_failure()
+                # The request never reached Notion, always safe to send again
+                if attempt >= self.max_retries or not self.online:
+                    self.online = False
+                    raise
+                time.sleep(self._backoff(attempt))
+            except (RequestTimeoutError, httpx.TransportError):
+                self.breaker.record_failure()
+                if attempt >= self.max_retries or not idempotent or not self.online:
+                    self.online = False
+                    raise
+                time.sleep(self._backoff(attempt))
+            except BaseException:
+                # Says nothing about Notion, let another request probe it
+                self.breaker.release()
+                raise
+            else:
+                self.breaker.record_success()
+                self.online = True
+                self._recover()
+                return result
+            attempt += 1
+            self.retries += 1
+
+    def stats(self):
+        """Return the scheduler's counters"""
+        with self._cond:
+            return {
+                'queue_depth': len(self._waiting),
+                'max_queue_depth': self.max_queue_depth,
+                'requests': self.requests,
+                'retries': self.retries,
+                'rate_limited': self.rate_limited,
+                'throttled_seconds': round(self.throttled_seconds, 3),
+                'current_rate': round(self._current_rate, 3),
+                'online': self.online,
+            }
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Durable write-behind queue for scans waiting to be written to Notion
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message TEXT NOT NULL,
+    station TEXT NOT NULL DEFAULT 'default',
+    action TEXT NOT NULL,
+    route TEXT,
+    target_id INTEGER,
+    target_page_id TEXT,
+    uid TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    page_id TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scans_status ON scans (status, id);
+CREATE INDEX IF NOT EXISTS scans_target ON scans (target_id);
+"""
+
+# Columns added after the first release, with their definitions
+MIGRATIONS = [
+    ('station', "TEXT NOT NULL DEFAULT 'default'"),
+    ('target_page_id', "TEXT"),
+    ('uid', "TEXT"),
+    ('sent', "INTEGER NOT NULL DEFAULT 0"),
+]
+
+# A mastercode update may only run once the entry it targets has been written,
+# and after any earlier update of the same entry. A station's new entries are
+# written in the order they were scanned. A new entry is held for the
+# coalescing window unless its mastercode is already queued. Rows stuck in
+# 'sending' were left behind by a worker that died and are picked up again.
+CLAIM_QUERY = """
+SELECT * FROM scans s
+WHERE ((s.status = 'pending' AND s.next_attempt_at <= ?) OR (s.status = 'sending' AND s.updated_at < ?))
+  AND (s.action != 'create' OR s.created_at <= ? OR EXISTS (
+      SELECT 1 FROM scans u WHERE u.target_id = s.id))
+  AND (s.target_id IS NULL OR EXISTS (
+      SELECT 1 FROM scans t WHERE t.id = s.target_id AND t.status IN ('done', 'failed')))
+  AND NOT EXISTS (
+      SELECT 1 FROM scans e WHERE e.target_id = s.target_id AND e.id < s.id AND e.status IN ('pending', 'sending'))
+  AND (s.action != 'create' OR NOT EXISTS (
+      SELECT 1 FROM scans c WHERE c.station = s.station AND c.action = 'create' AND c.id < s.id
+        AND c.status IN ('pending', 'sending')))
+ORDER BY s.id LIMIT 1
+"""
+
+
+class ScanQueue:
+    """Append-only SQLite journal of scans, drained to Notion by a pool of worker threads.
+
+    Each row is either a ``create`` (a new entry) or an ``update`` (a mastercode
+    route applied to the entry created by row ``target_id``). ``handler`` is
+    called with the row as a dict and returns ``(success, result)`` like the
+    other Notion helpers; failures are retried with exponential backoff.
+    Several processes may drain the same journal: rows are claimed with a
+    compare-and-set, and a row left 'sending' for ``stale_after`` seconds (its
+    worker died) is sent again.
+
+    New entries wait up to ``hold_window`` seconds before being sent. Any
+    mastercode updates already queued for an entry when it is claimed are
+    merged into it: the handler gets their route in ``scan['route']`` and a
+    single create covers them all.
+
+    ``is_offline`` is a callable saying whether Notion is currently
+    unreachable. A scan that fails while offline goes back to pending without
+    using up an attempt, and the workers pause for ``offline_retry`` seconds
+    before the next scan probes the connection again.
+
+    ``scan['sent']`` tells the handler whether an earlier attempt may have
+    reached Notion (it is set on every claim and kept when an offline failure
+    gives the attempt back), so it can check for the entry before creating it.
+    """
+
+    def __init__(self, path, handler, workers=2, max_attempts=5, retry_delay=1.0, stale_after=120, hold_window=0,
+                 is_offline=None, offline_retry=15.0):
+        self.path = path
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.stale_after = stale_after
+        self.hold_window = hold_window
+        self.is_offline = is_offline
+        self.offline_retry = offline_retry
+        self._paused_until = 0.0
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        columns = {row['name'] for row in self._conn.execute('PRAGMA table_info(scans)')}
+        for column, definition in MIGRATIONS:
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE scans ADD COLUMN {column} {definition}")
+                if column == 'sent':
+                    self._conn.execute("UPDATE scans SET sent = 1 WHERE attempts > 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS scans_station ON scans (station, action, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS scans_station_status ON scans (station, status)")
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stop = threading.Event()
+        self._threads = []
+
+    def enqueue(self, message, station='default', route=None, last_page_id=None, uid=None, attempts=0):
+        """Append a scan to the journal and return its queue ID.
+
+        Scans with a ``route`` are mastercodes: they become an update of the
+        station's newest entry, resolved here so concurrent scans can't race.
+        That is the station's newest queued entry while it is still waiting to
+        be written, and otherwise ``last_page_id``, the station's last entry
+        already in Notion.
+
+        ``uid`` identifies the scan across retries (one is generated when not
+        given). A scan that may already have reached Notion once is queued
+        with ``attempts=1``, which also marks it as ``sent``.
+        """
+        now = time.time()
+        with self._lock:
+            target_id = None
+            if route is None:
+                action = 'create'
+            else:
+                action = 'update'
+                row = self._conn.execute(
+                    "SELECT id, status FROM scans WHERE station = ? AND action = 'create' ORDER BY id DESC LIMIT 1", (station,)
+                ).fetchone()
+                if row and row['status'] in ('pending', 'sending'):
+                    target_id = row['id']
+            cursor = self._conn.execute(
+                "INSERT INTO scans (message, station, action, route, target_id, target_page_id, uid, attempts, sent, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (message, station, action, route, target_id, None if target_id else last_page_id,
+                 uid or uuid.uuid4().hex, attempts, int(attempts > 0), now, now)
+            )
+            self._wakeup.notify()
+            return cursor.lastrowid
+
+    def has_pending(self, station):
+        """Whether a station still has scans waiting to be written"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM scans WHERE station = ? AND status IN ('pending', 'sending') LIMIT 1", (station,)
+            ).fetchone()
+        return row is not None
+
+    def get(self, scan_id):
+        """Return a queued scan as a dict, or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM scans WHERE id = ?", (scan_id,)).fetchone()
+        return dict(row) if row else None
+
+    def counts(self):
+        """Return the number of queued scans per status"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM scans GROUP BY status").fetchall()
+        return {row['status']: row['n'] for row in rows}
+
+    def _claim(self):
+        with self._lock:
+            while not self._stop.is_set():
+                now = time.time()
+                if now < self._paused_until:
+                    # Notion is unreachable, wait before sending the next probe
+                    self._wakeup.wait(self._paused_until - now)
+                    continue
+                row = self._conn.execute(CLAIM_QUERY, (now, now - self.stale_after, now - self.hold_window)).fetchone()
+                if row:
+                    claimed = self._conn.execute(
+                        "UPDATE scans SET status = 'sending', attempts = attempts + 1, sent = 1, updated_at = ? "
+                        "WHERE id = ? AND status = ? AND updated_at = ?",
+                        (now, row['id'], row['status'], row['updated_at'])
+                    ).rowcount
+                    if not claimed:
+                        # Another worker process sharing the journal got there first
+                        continue
+                    scan = dict(row)
+                    scan['attempts'] += 1
+                    scan['merged_ids'] = []
+                    if scan['action'] == 'create':
+                        self._merge_updates(scan, now)
+                    if scan['target_id'] is not None:
+                        target = self._conn.execute("SELECT page_id FROM scans WHERE id = ?", (scan['target_id'],)).fetchone()
+                        scan['target_page_id'] = target['page_id'] if target else None
+                    return scan
+                # Nothing ready: sleep until a new scan arrives, a retry comes due or a held entry is released
+                self._wakeup.wait(min(self.retry_delay, self.hold_window) if self.hold_window else self.retry_delay)
+        return None
+
+    def _merge_updates(self, scan, now):
+        updates = self._conn.execute(
+            "SELECT id, route FROM scans WHERE target_id = ? AND status = 'pending' ORDER BY id", (scan['id'],)
+        ).fetchall()
+        for update in updates:
+            claimed = self._conn.execute(
+                "UPDATE scans SET status = 'sending', updated_at = ? WHERE id = ? AND status = 'pending'",
+                (now, update['id'])
+            ).rowcount
+            if claimed:
+                # The last mastercode wins, as when the updates are sent one by one
+                scan['route'] = update['route']
+                scan['merged_ids'].append(update['id'])
+
+    def _finish(self, scan, success, result, offline=False):
+        now = time.time()
+        with self._lock:
+            if offline:
+                # Not the scan's fault: keep it (and anything merged into it) for when Notion is back
+                self._paused_until = now + self.offline_retry
+                self._conn.execute(
+                    f"UPDATE scans SET status = 'pending', updated_at = ? WHERE id IN ({', '.join('?' * (len(scan['merged_ids']) + 1))})",
+                    (now, scan['id'], *scan['merged_ids'])
+                )
+                self._conn.execute(
+                    "UPDATE scans SET attempts = attempts - 1, error = ? WHERE id = ?", (result, scan['id'])
+                )
+                return
+            for merged_id in scan['merged_ids']:
+                # Merged updates share the entry's outcome; if it failed they run on their own later
+                self._conn.execute(
+                    "UPDATE scans SET status = ?, page_id = ?, updated_at = ? WHERE id = ?",
+                    ('done' if success else 'pending', result if success else None, now, merged_id)
+                )
+            if success:
+                self._conn.execute(
+                    "UPDATE scans SET status = 'done', page_id = ?, error = NULL, updated_at = ? WHERE id = ?",
+                    (result, now, scan['id'])
+                )
+            elif scan['attempts'] >= self.max_attempts:
+                self._conn.execute(
+                    "UPDATE scans SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                    (result, now, scan['id'])
+                )
+            else:
+                delay = self.retry_delay * (2 ** (scan['attempts'] - 1))
+                self._conn.execute(
+                    "UPDATE scans SET status = 'pending', error = ?, next_attempt_at = ?, updated_at = ? WHERE id = ?",
+                    (result, now + delay, now, scan['id'])
+                )
+            # A finished entry may unblock a mastercode update waiting on it
+            self._wakeup.notify_all()
+
+    def _run(self):
+        while not self._stop.is_set():
+            scan = self._claim()
+            if scan is None:
+                break
+            try:
+                success, result = self.handler(scan)
+            except Exception as e:
+                success, result = False, str(e)
+            offline = not success and self.is_offline is not None and self.is_offline()
+            if offline:
+                logger.warning("Notion unreachable, queued scan kept for later", extra={'queue_id': scan['id']})
+            elif not success:
+                logger.warning("Queued scan failed", extra={'queue_id': scan['id'], 'attempt': scan['attempts'], 'error': result})
+            self._finish(scan, success, result, offline)
+
+    def start(self):
+        """Start the worker threads"""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'scan-queue-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    @property
+    def offline(self):
+        """Whether the workers are paused waiting for Notion to come back"""
+        return time.time() < self._paused_until
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            self._wakeup.notify_all()
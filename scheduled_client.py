@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Notion client whose requests are paced by a RequestScheduler
+"""
+
+import time
+
+import httpx
+from notion_client import Client
+from notion_client.errors import HTTPResponseError
+
+from metrics import NOTION_REQUEST_SECONDS, NOTION_REQUESTS, notion_endpoint
+
+
+class ScheduledClient(Client):
+    """Notion client whose every API request goes through a RequestScheduler.
+
+    Each attempt is counted and timed per endpoint in the process metrics, and
+    times out after the scheduler's timeout for its endpoint.
+    """
+
+    def __init__(self, scheduler, *args, **kwargs):
+        self.scheduler = scheduler
+        super().__init__(*args, **kwargs)
+
+    def _timed_request(self, endpoint, *args):
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            result = super().request(*args)
+            status = '200'
+            return result
+        except HTTPResponseError as e:
+            status = str(e.status)
+            raise
+        finally:
+            NOTION_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint)
+            NOTION_REQUESTS.inc(endpoint, status)
+
+    def _build_request(self, method, path, query=None, body=None, auth=None):
+        request = super()._build_request(method, path, query, body, auth)
+        # A slow Notion shouldn't hold a scan for the client's default minute
+        timeout = self.scheduler.timeout(notion_endpoint(path, method))
+        request.extensions['timeout'] = httpx.Timeout(timeout).as_dict()
+        return request
+
+    def request(self, path, method, query=None, body=None, auth=None):
+        idempotent = not (method.upper() == 'POST' and path == 'pages')
+        return self.scheduler.call(self._timed_request, notion_endpoint(path, method), path, method, query, body, auth,
+                                   idempotent=idempotent)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+TTL cache of Notion database property schemas
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaCache:
+    """Caches ``databases.retrieve`` properties per database ID for ``ttl`` seconds.
+
+    Property names are then resolved locally instead of retrieving a page or
+    probing Notion with a create call that might fail.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._schemas = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._schemas)
+
+    def properties(self, client, database_id):
+        """Return {property name: property schema} for a database, or None if it can't be retrieved"""
+        entry = self._schemas.get(database_id)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+
+        try:
+            database = client.databases.retrieve(database_id)
+        except Exception as e:
+            logger.warning("Error retrieving database schema", extra={'database_id': database_id, 'error': str(e)})
+            return None
+
+        properties = database.get('properties', {})
+        with self._lock:
+            self._schemas[database_id] = (properties, time.monotonic())
+        return properties
+
+    def title_property(self, client, database_id, candidates):
+        """Return the first candidate that is the database's title property.
+
+        Falls back to the title property's actual name when none of the
+        candidates match, and None when the schema is unavailable.
+        """
+        properties = self.properties(client, database_id)
+        if properties is None:
+            return None
+        for name in candidates:
+            if properties.get(name, {}).get('type') == 'title':
+                return name
+        for name, schema in properties.items():
+            if schema.get('type') == 'title':
+                return name
+        return None
+
+    def invalidate(self, database_id=None):
+        """Forget one database's schema, or all of them"""
+        with self._lock:
+            if database_id is None:
+                self._schemas.clear()
+            else:
+                self._schemas.pop(database_id, None)
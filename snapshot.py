@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Local SQLite snapshot of the main scan database, synced incrementally and queried offline
+"""
+
+import itertools
+import sqlite3
+import time
+
+from guide_index import iter_database_pages
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    page_id TEXT PRIMARY KEY,
+    message TEXT,
+    route TEXT,
+    scan_id TEXT,
+    created_time TEXT,
+    last_edited_time TEXT,
+    synced_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_route ON entries (route);
+CREATE INDEX IF NOT EXISTS entries_message ON entries (message);
+CREATE TABLE IF NOT EXISTS sync_state (
+    database_id TEXT PRIMARY KEY,
+    last_edited_time TEXT,
+    synced_at REAL NOT NULL,
+    pages INTEGER NOT NULL
+);
+"""
+
+UPSERT_QUERY = """
+INSERT OR REPLACE INTO entries (page_id, message, route, scan_id, created_time, last_edited_time, synced_at)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Rows written per transaction while syncing
+CHUNK_SIZE = 500
+
+
+def property_text(page, property_name):
+    """Return the plain text of a title, rich_text or select property, or None when empty"""
+    if not property_name:
+        return None
+    data = page.get('properties', {}).get(property_name, {})
+    kind = data.get('type')
+    if kind in ('title', 'rich_text'):
+        text = ''.join(part.get('plain_text') or part.get('text', {}).get('content', '') for part in data[kind])
+        return text or None
+    if kind == 'select':
+        return (data['select'] or {}).get('name')
+    return None
+
+
+def entry_rows(pages, title_property, route_property=None, scan_id_property=None, synced_at=None):
+    """Yield one ``entries`` row per page of a stream of Notion pages"""
+    synced_at = synced_at or time.time()
+    for page in pages:
+        yield (
+            page['id'],
+            property_text(page, title_property),
+            property_text(page, route_property),
+            property_text(page, scan_id_property),
+            page.get('created_time'),
+            page.get('last_edited_time'),
+            synced_at,
+        )
+
+
+class Snapshot:
+    """SQLite copy of the main database's entries, for reconciling routes without the Notion API.
+
+    ``sync`` only asks Notion for pages edited since the previous sync, and
+    streams them into the file in chunks, so memory stays flat however large
+    the database is. Archived pages never show up in a query; a ``full`` sync
+    re-reads every page and drops the entries it didn't see.
+    """
+
+    def __init__(self, path='notion_snapshot.db'):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def last_sync(self, database_id):
+        """Return ``(last_edited_time, synced_at, pages)`` of the previous sync, or None"""
+        return self._conn.execute(
+            "SELECT last_edited_time, synced_at, pages FROM sync_state WHERE database_id = ?", (database_id,)
+        ).fetchone()
+
+    def sync(self, client, database_id, title_property, route_property=None, scan_id_property=None, full=False):
+        """Fetch pages edited since the previous sync (all of them if ``full``) into the snapshot.
+
+        Returns ``{'pages', 'removed', 'seconds', 'last_edited_time'}``. The
+        sync position only advances once every page has been written, so an
+        interrupted sync is picked up again from the same point.
+        """
+        started = time.time()
+        previous = None if full else self.last_sync(database_id)
+        query = {}
+        if previous and previous[0]:
+            # Notion compares timestamps to the minute, so pages edited in the
+            # same minute as the last one seen are fetched again and replaced
+            query['filter'] = {
+                "timestamp": "last_edited_time",
+                "last_edited_time": {"on_or_after": previous[0]}
+            }
+
+        last_edited_time = previous[0] if previous else None
+        pages = 0
+        rows = entry_rows(iter_database_pages(client, database_id, **query),
+                          title_property, route_property, scan_id_property, started)
+        while True:
+            chunk = list(itertools.islice(rows, CHUNK_SIZE))
+            if not chunk:
+                break
+            with self._conn:
+                self._conn.executemany(UPSERT_QUERY, chunk)
+            pages += len(chunk)
+            last_edited_time = max([last_edited_time or ''] + [row[5] or '' for row in chunk]) or None
+
+        removed = 0
+        with self._conn:
+            if full:
+                removed = self._conn.execute("DELETE FROM entries WHERE synced_at < ?", (started,)).rowcount
+            total = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (database_id, last_edited_time, synced_at, pages) VALUES (?, ?, ?, ?)",
+                (database_id, last_edited_time, started, total)
+            )
+        return {'pages': pages, 'removed': removed, 'seconds': round(time.time() - started, 3),
+                'last_edited_time': last_edited_time}
+
+    def _entries(self, where, params=()):
+        cursor = self._conn.execute(
+            f"SELECT page_id, message, route, scan_id, created_time, last_edited_time FROM entries WHERE {where} "
+            "ORDER BY created_time, page_id", params
+        )
+        columns = [column[0] for column in cursor.description]
+        for row in cursor:
+            yield dict(zip(columns, row))
+
+    def entries_by_route(self, route):
+        """Yield the entries that have ``route`` attached"""
+        return self._entries("route = ?", (route,))
+
+    def entries_missing_route(self):
+        """Yield the entries no mastercode has attached a route to"""
+        return self._entries("route IS NULL")
+
+    def counts_by_barcode(self, minimum=1):
+        """Yield ``(barcode, entries)`` for each scanned barcode with at least ``minimum`` entries, most first"""
+        return self._conn.execute(
+            "SELECT message, COUNT(*) AS entries FROM entries GROUP BY message HAVING entries >= ? "
+            "ORDER BY entries DESC, message", (minimum,)
+        )
+
+    def counts_by_route(self):
+        """Yield ``(route, entries)`` for each route, with None for entries without one"""
+        return self._conn.execute(
+            "SELECT route, COUNT(*) AS entries FROM entries GROUP BY route ORDER BY entries DESC, route"
+        )
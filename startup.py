@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Cold-start helpers: claim the port before the heavy imports and time each startup milestone
+
+Kept to the standard library so it loads in a few milliseconds; app.py imports
+it first and calls ``listen`` before Flask and the Notion client are loaded.
+"""
+
+import socket
+import threading
+import time
+
+STARTED = time.perf_counter()
+
+_timings = {}
+_timings_lock = threading.Lock()
+_socket = None
+
+
+def mark(milestone):
+    """Record the milliseconds since startup the first time ``milestone`` is reached.
+
+    Returns the recorded value, or None if the milestone was already marked.
+    """
+    elapsed = round((time.perf_counter() - STARTED) * 1000, 1)
+    with _timings_lock:
+        if milestone in _timings:
+            return None
+        _timings[milestone] = elapsed
+    return elapsed
+
+
+def timings():
+    """Startup milestones reached so far, in milliseconds since the process started"""
+    with _timings_lock:
+        return dict(_timings)
+
+
+def _open_browser(port):
+    import webbrowser
+    webbrowser.open(f'http://localhost:{port}')
+    mark('browser_opened_ms')
+
+
+def listen(port, open_browser=False):
+    """Bind and listen on ``port`` now, so a browser can connect while the app is still loading.
+
+    Connections wait in the listen backlog until the server takes the socket
+    over (see ``take_socket``), which replaces the old fixed delay before
+    opening the browser.
+    """
+    global _socket
+    _socket = socket.create_server(('0.0.0.0', port), backlog=128)
+    mark('listening_ms')
+    if open_browser:
+        threading.Thread(target=_open_browser, args=(port,), daemon=True).start()
+    return _socket
+
+
+def take_socket():
+    """Hand over the socket opened by ``listen`` (None if it wasn't called)"""
+    global _socket
+    sock, _socket = _socket, None
+    return sock
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Per-station scan state (the last entry each scanner station created)
+"""
+
+import sqlite3
+import threading
+import time
+
+
+class MemoryStationStore:
+    """Station state held in this process only"""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get_last_entry(self, station):
+        return self._entries.get(station)
+
+    def set_last_entry(self, station, page_id):
+        with self._lock:
+            self._entries[station] = page_id
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteStationStore:
+    """Station state in a local SQLite file, shared by every worker process using the same path"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS stations (station TEXT PRIMARY KEY, last_entry_id TEXT, updated_at REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def get_last_entry(self, station):
+        with self._lock:
+            row = self._conn.execute("SELECT last_entry_id FROM stations WHERE station = ?", (station,)).fetchone()
+        return row[0] if row else None
+
+    def set_last_entry(self, station, page_id):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO stations (station, last_entry_id, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(station) DO UPDATE SET last_entry_id = excluded.last_entry_id, updated_at = excluded.updated_at",
+                (station, page_id, time.time())
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM stations").fetchone()[0]
+
+
+def create_station_store(backend='memory', path='stations.db'):
+    """Return the station store for a backend name ('memory' or 'sqlite')"""
+    if backend == 'memory':
+        return MemoryStationStore()
+    if backend == 'sqlite':
+        return SQLiteStationStore(path)
+    raise ValueError(f"Unknown station state backend: {backend}")
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Multi-tenant routing: one process serving several warehouses, each with its own Notion workspace
+"""
+
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+
+from app_context import AppContext
+
+logger = logging.getLogger(__name__)
+
+# The tenant configured by .env, used for stations and URLs no other tenant claims
+DEFAULT_TENANT = 'default'
+
+# WSGI environ key the prefix middleware stores the tenant's name under
+ENVIRON_KEY = 'notionfords.tenant'
+
+_local = threading.local()
+
+
+class Tenant:
+    """One warehouse: its configuration and Notion client, and the caches and queue built from them.
+
+    ``context`` is the tenant's own AppContext, so each tenant has a separate
+    connection pool, schema cache and request scheduler (Notion's rate limit
+    applies per integration, so one site's backlog never slows another's).
+    ``guide_index`` and ``scan_queue`` are filled in by app.py on first use.
+    """
+
+    def __init__(self, name, context, prefix=None, stations=()):
+        self.name = name
+        self.context = context
+        self.prefix = prefix
+        self.stations = set(stations)
+
+        self.guide_index = None
+        self.guide_index_config = None
+        self.guide_index_lock = threading.Lock()
+        self.scan_queue = None
+        self.scan_queue_lock = threading.Lock()
+
+    @property
+    def is_default(self):
+        return self.name == DEFAULT_TENANT
+
+    def station_key(self, station):
+        """Name a station uniquely across tenants, for the shared station store and caches"""
+        return station if self.is_default else f'{self.name}/{station}'
+
+    def path(self, path):
+        """This tenant's copy of a local file, e.g. ``scan_queue.site-a.db`` (empty paths stay empty)"""
+        if not path or self.is_default:
+            return path
+        root, ext = os.path.splitext(path)
+        return f'{root}.{self.name}{ext}'
+
+
+def tenant_loader(settings):
+    """Return a loader giving a tenant's settings in the same shape as ``load_environment``"""
+    def load():
+        # Tokens may be kept out of the tenants file in an environment variable
+        token = settings.get('token') or os.getenv(settings.get('token_env', ''))
+        barcode_properties = settings.get('barcode_properties', 'barcode,Barcode,BARCODE')
+        if isinstance(barcode_properties, str):
+            barcode_properties = barcode_properties.split(',')
+        return (
+            token,
+            settings.get('database_id'),
+            settings.get('guide_database_id'),
+            settings.get('message_property', 'Message'),
+            settings.get('name_property', 'Name'),
+            barcode_properties,
+            settings.get('mastercode_property', 'Mastercode'),
+            settings.get('route_property', 'Route'),
+        )
+    return load
+
+
+class TenantRegistry:
+    """Maps scanner stations and URL prefixes to tenants.
+
+    The tenants are read from the JSON file named by ``NOTION_TENANTS_PATH``
+    the first time they are needed (after .env has been loaded by the default
+    tenant's context). Without that setting the default tenant serves
+    everything, exactly as in single-tenant mode.
+    """
+
+    def __init__(self, default_context):
+        self.default = Tenant(DEFAULT_TENANT, default_context)
+        self._tenants = None
+        self._stations = {}
+        self._prefixes = []
+        self._lock = threading.Lock()
+
+    def _load(self):
+        self.default.context.config()
+        path = os.getenv('NOTION_TENANTS_PATH')
+        tenants = {DEFAULT_TENANT: self.default}
+        if path:
+            with open(path) as f:
+                definitions = json.load(f)
+            for name, settings in definitions.items():
+                if name == DEFAULT_TENANT or '/' in name:
+                    raise ValueError(f"Invalid tenant name in {path}: {name!r}")
+                prefix = settings.get('prefix')
+                if prefix:
+                    prefix = '/' + prefix.strip('/')
+                context = AppContext(
+                    tenant_loader(settings),
+                    env_path=self.default.context.env_path,
+                    max_connections=int(settings.get('max_connections', self.default.context.max_connections)),
+                    rate=settings.get('rate_limit'),
+                    burst=settings.get('rate_burst'),
+                    base_url=settings.get('base_url'),
+                )
+                tenants[name] = Tenant(name, context, prefix, settings.get('stations', ()))
+            logger.info("Tenants loaded", extra={'path': path, 'tenants': sorted(tenants)})
+
+        self._stations = {station: tenant for tenant in tenants.values() for station in tenant.stations}
+        # Longest prefix first, so /site-a/north wins over /site-a
+        self._prefixes = sorted(((tenant.prefix, tenant) for tenant in tenants.values() if tenant.prefix),
+                                key=lambda item: len(item[0]), reverse=True)
+        self._tenants = tenants
+        return tenants
+
+    def _all(self):
+        tenants = self._tenants
+        if tenants is None:
+            with self._lock:
+                tenants = self._tenants or self._load()
+        return tenants
+
+    def __iter__(self):
+        return iter(list(self._all().values()))
+
+    def __len__(self):
+        return len(self._all())
+
+    def get(self, name):
+        """Return the tenant with this name, or None"""
+        return self._all().get(name)
+
+    def for_station(self, station):
+        """Return the tenant a station is assigned to, or the default tenant"""
+        self._all()
+        return self._stations.get(station, self.default)
+
+    def for_path(self, path):
+        """Return ``(tenant, prefix)`` for a URL path under a tenant's prefix, or None"""
+        self._all()
+        for prefix, tenant in self._prefixes:
+            if path == prefix or path.startswith(prefix + '/'):
+                return tenant, prefix
+        return None
+
+
+class TenantPrefixMiddleware:
+    """WSGI middleware serving each tenant under its URL prefix.
+
+    The prefix moves from PATH_INFO to SCRIPT_NAME, so the app's routes and
+    ``request.script_root`` work unchanged below it, and the tenant's name is
+    left in the environ for the app to pick up.
+    """
+
+    def __init__(self, wsgi_app, registry):
+        self.wsgi_app = wsgi_app
+        self.registry = registry
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        match = self.registry.for_path(path)
+        if match:
+            tenant, prefix = match
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + prefix
+            environ['PATH_INFO'] = path[len(prefix):] or '/'
+            environ[ENVIRON_KEY] = tenant.name
+        return self.wsgi_app(environ, start_response)
+
+
+@contextmanager
+def use_tenant(tenant):
+    """Make ``tenant`` the one ``current_tenant`` returns inside this block"""
+    previous = getattr(_local, 'tenant', None)
+    _local.tenant = tenant
+    try:
+        yield tenant
+    finally:
+        _local.tenant = previous
+
+
+def current_tenant(default=None):
+    """Return the tenant whose scan this thread is handling, or ``default``"""
+    return getattr(_local, 'tenant', None) or default
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+
+import pytest
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_notion import FakeNotion, start_fake_notion  # noqa: E402
+
+
+def wait_for(condition, timeout=10):
+    """Poll ``condition`` until it returns something truthy, failing the test after ``timeout`` seconds"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.02)
+    pytest.fail('timed out waiting for condition')
+
+
+@pytest.fixture
+def fake_notion():
+    server = start_fake_notion(api=FakeNotion())
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture
+def web_app(fake_notion, tmp_path, monkeypatch):
+    """The app configured against a fresh fake Notion, with its per-process state reset afterwards"""
+    settings = {
+        'NOTION_TOKEN': 'test-token',
+        'NOTION_BASE_URL': fake_notion.url,
+        'NOTION_DATABASE_ID': 'fake-database',
+        'NOTION_GUIDE_DATABASE_ID': 'fake-guide',
+        'NOTION_BARCODE_PROPERTIES': 'Barcode',
+        'NOTION_SCAN_ID_PROPERTY': '',
+        'NOTION_RATE_LIMIT': '1000',
+        'NOTION_RATE_BURST': '1000',
+        'NOTION_QUEUE_PATH': str(tmp_path / 'scan_queue.db'),
+        'NOTION_GUIDE_CACHE_PATH': '',
+        'NOTION_STATION_BACKEND': 'memory',
+        'NOTION_DEBOUNCE_MS': '0',
+        'NOTION_TENANTS_PATH': '',
+        'NOTION_LOG_LEVEL': 'WARNING',
+    }
+    for name, value in settings.items():
+        monkeypatch.setenv(name, value)
+
+    import app
+    monkeypatch.setattr(app.context, 'env_path', os.devnull)
+    app.context.invalidate()
+    # Tenants are read again from this test's NOTION_TENANTS_PATH
+    monkeypatch.setattr(app.tenants, '_tenants', None)
+    yield app
+
+    for tenant in app.tenants:
+        if tenant.scan_queue is not None:
+            tenant.scan_queue.stop()
+            tenant.scan_queue = None
+        if tenant.guide_index is not None:
+            tenant.guide_index.stop()
+            tenant.guide_index = None
+    app.station_store = None
+    app.idempotency_cache = None
@@ -0,0 +1,32 @@
+from io import StringIO
+
+from batch import iter_scans
+
+
+def test_batch_concurrency_is_validated(web_app):
+    client = web_app.app.test_client()
+    response = client.post('/store/batch?concurrency=lots', data='{"message": "ITEM-A"}\n')
+    assert response.status_code == 200
+    assert response.get_json() == {'success': False, 'error': "Invalid concurrency: 'lots'"}
+
+
+def test_batch_concurrency_is_capped(web_app, monkeypatch):
+    monkeypatch.setenv('NOTION_BATCH_MAX_CONCURRENCY', '4')
+    used = []
+
+    def run_batch(scans, *args):
+        used.append(args[-1])
+        return iter(())
+
+    monkeypatch.setattr(web_app, 'run_batch', run_batch)
+    client = web_app.app.test_client()
+    for requested in ('1000', '0', '2'):
+        client.post(f'/store/batch?concurrency={requested}', data='').get_data()
+    assert used == [4, 1, 2]
+
+
+def test_csv_header_is_optional():
+    assert list(iter_scans(StringIO('ITEM-1\nMC1\nITEM-2\n'), 'csv')) == [
+        (1, 'ITEM-1', None), (2, 'MC1', None), (3, 'ITEM-2', None)]
+    assert list(iter_scans(StringIO('station,Message\nS1,ITEM-1\nS1,\n'), 'csv')) == [
+        (2, 'ITEM-1', None), (3, None, 'No message provided')]
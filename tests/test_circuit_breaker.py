@@ -0,0 +1,69 @@
+import pytest
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from notion_scheduler import RequestScheduler
+
+
+def open_breaker(monkeypatch, now):
+    """A breaker opened by two failures at ``now[0]``, with a 30 second reset timeout"""
+    monkeypatch.setattr('circuit_breaker.time.monotonic', lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    return breaker
+
+
+def test_open_half_open_closed(monkeypatch):
+    now = [100.0]
+    breaker = open_breaker(monkeypatch, now)
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    # After the reset timeout a single probe is let through
+    now[0] += 30
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+    assert breaker.stats()['opened'] == 1
+    assert breaker.stats()['rejected'] == 2
+
+
+def test_failed_probe_reopens(monkeypatch):
+    now = [100.0]
+    breaker = open_breaker(monkeypatch, now)
+    now[0] += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.stats()['opened'] == 2
+
+    # Open for another full reset timeout
+    now[0] += 29
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    now[0] += 1
+    assert breaker.allow()
+
+
+def test_unanswered_probe_is_released(monkeypatch):
+    now = [100.0]
+    breaker = open_breaker(monkeypatch, now)
+    now[0] += 30
+    scheduler = RequestScheduler(rate=1000, burst=1000, breaker=breaker)
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.call(interrupted)
+    # The circuit stays half-open and the next request is the probe
+    assert breaker.state == HALF_OPEN
+    assert scheduler.call(lambda: 'answer') == 'answer'
+    assert breaker.state == CLOSED
@@ -0,0 +1,82 @@
+import threading
+import time
+
+from idempotency import IdempotencyCache
+
+
+def test_duplicate_waits_for_the_request_in_flight():
+    cache = IdempotencyCache()
+    assert cache.begin('k') == (None, True)
+    answers = []
+    duplicate = threading.Thread(target=lambda: answers.append(cache.begin('k')))
+    duplicate.start()
+    duplicate.join(0.2)
+    # Still waiting for the owner
+    assert duplicate.is_alive()
+
+    cache.complete('k', {'success': True})
+    duplicate.join(5)
+    assert answers == [({'success': True}, False)]
+    assert cache.begin('k') == ({'success': True}, False)
+
+
+def test_duplicate_of_a_failed_request_handles_it_itself():
+    cache = IdempotencyCache()
+    assert cache.begin('k') == (None, True)
+    answers = []
+    duplicate = threading.Thread(target=lambda: answers.append(cache.begin('k')))
+    duplicate.start()
+    cache.complete('k', None)
+    duplicate.join(5)
+    assert answers == [(None, False)]
+    # Nothing stored, the next retry owns the key again
+    assert cache.begin('k') == (None, True)
+
+
+def test_responses_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('idempotency.time.time', lambda: now[0])
+    cache = IdempotencyCache(ttl=10)
+    cache.begin('k')
+    cache.complete('k', {'success': True})
+
+    now[0] += 10
+    assert cache.get('k') == {'success': True}
+    # A shorter max age than the TTL is honoured too
+    assert cache.get('k', max_age=5) is None
+    now[0] += 1
+    assert cache.get('k') is None
+    assert cache.begin('k') == (None, True)
+
+
+def test_entries_read_from_the_file_stay_bounded(tmp_path):
+    path = str(tmp_path / 'idempotency.db')
+    writer = IdempotencyCache(path=path)
+    for key in 'abcd':
+        writer.begin(key)
+        writer.complete(key, {'key': key})
+
+    reader = IdempotencyCache(max_entries=2, path=path)
+    assert [reader.get(key) for key in 'abcd'] == [{'key': key} for key in 'abcd']
+    assert len(reader) == 2
+
+
+def test_double_fire_straddling_two_buckets_is_a_duplicate(web_app, fake_notion, monkeypatch):
+    monkeypatch.setenv('NOTION_DEBOUNCE_MS', '1000')
+    now = [time.time() // 1 + 0.9]
+    # The app and the cache share this clock
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    client = web_app.app.test_client()
+
+    def store():
+        return client.post('/store', json={'message': 'ITEM-A', 'station': 'S1'}).get_json()
+
+    first = store()
+    assert first['success'] and 'duplicate' not in first
+    # 0.3 seconds later, but in the next debounce bucket
+    now[0] += 0.3
+    assert store() == dict(first, duplicate=True)
+    # A deliberate rescan after the window is stored again
+    now[0] += 1.5
+    assert 'duplicate' not in store()
+    assert fake_notion.api.calls['pages.create'] == 2
@@ -0,0 +1,108 @@
+import pytest
+from notion_client import Client
+
+from guide_index import GuideIndex
+from mastercode_rules import PREFIX, RANGE, REGEX, RuleSet, check_digit_valid
+
+
+def test_nested_and_overlapping_ranges():
+    rules = RuleSet([
+        (RANGE, 'R1000..R1999', 'Wide', False),
+        (RANGE, 'R1200..R1299', 'Narrow', False),
+        # Overlaps the end of the narrow range and starts after it, so it wins where they overlap
+        (RANGE, 'R1250..R1400', 'Overlap', False),
+    ])
+    expected = {
+        'R999': None,
+        'R1000': 'Wide',
+        'R1199': 'Wide',
+        'R1200': 'Narrow',
+        'R1249': 'Narrow',
+        'R1250': 'Overlap',
+        'R1299': 'Overlap',
+        'R1400': 'Overlap',
+        'R1401': 'Wide',
+        'R1999': 'Wide',
+        'R2000': None,
+        # Shorter codes sort first, so this isn't inside R1000..R1999
+        'R15': None,
+    }
+    assert {code: rules.lookup(code) for code in expected} == expected
+
+
+def test_range_sharing_a_bound():
+    rules = RuleSet([
+        (RANGE, '100..199', 'Low', False),
+        (RANGE, '199..299', 'High', False),
+    ])
+    assert [rules.lookup(code) for code in ('150', '199', '200', '299', '300')] == ['Low', 'High', 'High', 'High', None]
+
+
+def test_longest_prefix_wins():
+    rules = RuleSet([
+        (PREFIX, '40', 'Foods', False),
+        (PREFIX, '400', 'Germany', False),
+    ])
+    assert rules.lookup('4001') == 'Germany'
+    assert rules.lookup('4099') == 'Foods'
+    assert rules.lookup('40') == 'Foods'
+    assert rules.lookup('4') is None
+    assert rules.lookup('4100') is None
+
+
+def test_check_digit():
+    assert check_digit_valid('4006381333931')
+    assert check_digit_valid('5901234123457')
+    assert not check_digit_valid('4006381333932')
+    assert not check_digit_valid('400638133393X')
+    assert not check_digit_valid('7')
+
+
+def test_check_digit_rules_only_match_valid_codes():
+    rules = RuleSet([
+        (PREFIX, '400', 'Germany', False),
+        (PREFIX, '400638', 'Verified', True),
+        (RANGE, '5000000000000..5999999999999', 'Checked range', True),
+        (REGEX, r'\d{13}', 'Any EAN', False),
+    ])
+    # A longer prefix that fails its check digit falls back to a shorter one
+    assert rules.lookup('4006381333931') == 'Verified'
+    assert rules.lookup('4006381333932') == 'Germany'
+    # ...and a range that fails it falls back to a regex
+    assert rules.lookup('5901234123457') == 'Checked range'
+    assert rules.lookup('5901234123458') == 'Any EAN'
+
+
+def test_invalid_rules_are_counted_and_skipped():
+    rules = RuleSet([
+        (RANGE, 'R9..R1', 'Backwards', False),
+        (RANGE, 'R1', 'No bounds', False),
+        (REGEX, '(', 'Broken', False),
+        (PREFIX, '', 'Empty', False),
+        ('fuzzy', 'R1', 'Unknown', False),
+        (REGEX, r'PAL-\d+', 'Pallets', False),
+    ])
+    assert rules.counts == {PREFIX: 0, RANGE: 0, REGEX: 1, 'invalid': 5}
+    assert len(rules) == 1
+    assert rules.lookup('PAL-12') == 'Pallets'
+    assert rules.lookup('PAL-12x') is None
+
+
+@pytest.fixture
+def guide_index(fake_notion):
+    api = fake_notion.api
+    api.add_guide_entry('R1500', 'Exact')
+    api.add_guide_entry('R15', 'Prefix', match='Prefix')
+    api.add_guide_entry('R1000..R1999', 'Range', match='Range')
+    api.add_guide_entry(r'R\d+', 'Regex', match='Regex')
+    index = GuideIndex(Client(auth='test-token', base_url=fake_notion.url), api.guide_database_id)
+    index.build()
+    return index
+
+
+def test_exact_codes_win_over_prefixes_ranges_and_regexes(guide_index):
+    assert guide_index.lookup('R1500') == (True, 'Exact')
+    assert guide_index.lookup('R1501') == (True, 'Prefix')
+    assert guide_index.lookup('R1600') == (True, 'Range')
+    assert guide_index.lookup('R2500') == (True, 'Regex')
+    assert guide_index.lookup('X1') == (False, None)
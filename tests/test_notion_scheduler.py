@@ -0,0 +1,91 @@
+import threading
+import time
+
+import httpx
+import pytest
+from notion_client.errors import HTTPResponseError
+
+from conftest import wait_for
+from notion_scheduler import PRIORITY_HIGH, PRIORITY_NORMAL, RequestScheduler
+
+
+def http_error(status, headers=None):
+    request = httpx.Request('POST', 'https://api.notion.com/v1/pages')
+    return HTTPResponseError(httpx.Response(status, headers=headers, request=request))
+
+
+class Flaky:
+    """Fake Notion call raising the given errors in turn, then answering"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'answer'
+
+
+def test_retry_after_pauses_the_bucket_and_halves_the_rate():
+    scheduler = RequestScheduler(rate=10, burst=10, base_delay=0.01)
+    function = Flaky(http_error(429, {'Retry-After': '0.3'}))
+    started = time.monotonic()
+    assert scheduler.call(function) == 'answer'
+    assert time.monotonic() - started >= 0.3
+    assert function.calls == 2
+    assert scheduler.rate_limited == 1
+
+    # Halved, then raised by a twentieth of the rate for the request that succeeded
+    assert scheduler.stats()['current_rate'] == 5.5
+
+
+def test_paused_bucket_holds_up_other_callers():
+    scheduler = RequestScheduler(rate=10, burst=10, base_delay=0.01)
+    throttled = threading.Thread(target=scheduler.call, args=(Flaky(http_error(429, {'Retry-After': '0.5'})),))
+    throttled.start()
+    wait_for(lambda: scheduler.rate_limited)
+    started = time.monotonic()
+    scheduler.acquire()
+    assert time.monotonic() - started >= 0.3
+    throttled.join(5)
+
+
+def test_server_errors_are_only_retried_for_idempotent_calls():
+    scheduler = RequestScheduler(rate=1000, burst=1000, max_retries=2, base_delay=0.01)
+
+    create = Flaky(http_error(500), http_error(500))
+    with pytest.raises(HTTPResponseError):
+        scheduler.call(create, idempotent=False)
+    # A create that failed may still have created the page, it isn't sent again
+    assert create.calls == 1
+
+    query = Flaky(http_error(502), http_error(503))
+    assert scheduler.call(query) == 'answer'
+    assert query.calls == 3
+
+    # Client errors are never retried
+    update = Flaky(http_error(400))
+    with pytest.raises(HTTPResponseError):
+        scheduler.call(update)
+    assert update.calls == 1
+
+
+def test_high_priority_waiters_are_served_first():
+    scheduler = RequestScheduler(rate=2, burst=1)
+    scheduler.acquire()
+    order = []
+
+    def wait(name, priority):
+        scheduler.acquire(priority)
+        order.append(name)
+
+    normal = threading.Thread(target=wait, args=('normal', PRIORITY_NORMAL))
+    normal.start()
+    wait_for(lambda: scheduler.stats()['queue_depth'] == 1)
+    high = threading.Thread(target=wait, args=('high', PRIORITY_HIGH))
+    high.start()
+    normal.join(5)
+    high.join(5)
+    assert order == ['high', 'normal']
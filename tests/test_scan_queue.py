@@ -0,0 +1,146 @@
+import threading
+
+import pytest
+
+from conftest import wait_for
+from scan_queue import ScanQueue
+
+
+class Recorder:
+    """Queue handler recording every scan it is given, failing those named in ``failures`` once each"""
+
+    def __init__(self, failures=()):
+        self.calls = []
+        self.failures = list(failures)
+        self.blocked = {}
+        self.lock = threading.Lock()
+
+    def block(self, message):
+        self.blocked[message] = threading.Event()
+        return self.blocked[message]
+
+    def __call__(self, scan):
+        if scan['message'] in self.blocked:
+            self.blocked[scan['message']].wait(10)
+        with self.lock:
+            self.calls.append((scan['message'], scan['route'], scan['target_page_id']))
+            if scan['message'] in self.failures:
+                self.failures.remove(scan['message'])
+                return False, 'Conflict occurred while saving.'
+        return True, f"page-{scan['message']}"
+
+    def messages(self):
+        with self.lock:
+            return [call[0] for call in self.calls]
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    queues = []
+
+    def make(handler, **settings):
+        settings.setdefault('retry_delay', 0.05)
+        queue = ScanQueue(str(tmp_path / 'scan_queue.db'), handler, **settings)
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.stop()
+
+
+def test_station_entries_are_written_in_scan_order(make_queue):
+    handler = Recorder()
+    queue = make_queue(handler, workers=2)
+    release = handler.block('A1')
+    a1 = queue.enqueue('A1', 'S1')
+    a2 = queue.enqueue('A2', 'S1')
+    b1 = queue.enqueue('B1', 'S2')
+    queue.start()
+
+    # Another station isn't held up, but S1's second entry waits for its first
+    wait_for(lambda: queue.get(b1)['status'] == 'done')
+    assert queue.get(a2)['status'] == 'pending'
+    release.set()
+    wait_for(lambda: queue.get(a2)['status'] == 'done')
+    assert handler.messages() == ['B1', 'A1', 'A2']
+    assert queue.get(a1)['page_id'] == 'page-A1'
+
+
+def test_update_waits_for_the_entry_it_targets(make_queue):
+    handler = Recorder()
+    queue = make_queue(handler, workers=2)
+    release = handler.block('A1')
+    queue.enqueue('A1', 'S1')
+    queue.start()
+    wait_for(lambda: queue.counts().get('sending'))
+
+    # Queued while its entry is being written: sent after it, to the page it got
+    mastercode = queue.enqueue('MC1', 'S1', 'Dock-A')
+    release.set()
+    wait_for(lambda: queue.get(mastercode)['status'] == 'done')
+    assert handler.calls == [('A1', None, None), ('MC1', 'Dock-A', 'page-A1')]
+
+
+def test_queued_updates_merge_into_the_create(make_queue):
+    handler = Recorder()
+    queue = make_queue(handler, workers=1, hold_window=5)
+    item = queue.enqueue('A1', 'S1')
+    first = queue.enqueue('MC1', 'S1', 'Dock-A')
+    second = queue.enqueue('MC2', 'S1', 'Dock-B')
+    queue.start()
+
+    wait_for(lambda: queue.get(second)['status'] == 'done')
+    # One create carrying the last mastercode's route, without waiting out the hold window
+    assert handler.calls == [('A1', 'Dock-B', None)]
+    assert [queue.get(scan_id)['page_id'] for scan_id in (item, first, second)] == ['page-A1'] * 3
+
+
+def test_retried_create_merges_its_updates_again(make_queue):
+    handler = Recorder(failures=['A1'])
+    queue = make_queue(handler, workers=1)
+    item = queue.enqueue('A1', 'S1')
+    mastercode = queue.enqueue('MC1', 'S1', 'Dock-A')
+    queue.start()
+
+    wait_for(lambda: queue.get(mastercode)['status'] == 'done')
+    assert handler.calls == [('A1', 'Dock-A', None), ('A1', 'Dock-A', None)]
+    assert queue.get(item)['attempts'] == 2
+    assert queue.get(mastercode)['page_id'] == 'page-A1'
+
+
+def test_retried_update_keeps_its_target(make_queue):
+    handler = Recorder(failures=['MC1'])
+    queue = make_queue(handler, workers=1)
+    # The station's last entry is already in Notion
+    mastercode = queue.enqueue('MC1', 'S1', 'Dock-A', last_page_id='page-A0')
+    queue.start()
+    wait_for(lambda: queue.get(mastercode)['attempts'] >= 1)
+
+    # A new entry scanned while the update waits for its retry doesn't take it over
+    item = queue.enqueue('A1', 'S1')
+    wait_for(lambda: queue.get(mastercode)['status'] == 'done' and queue.get(item)['status'] == 'done')
+    assert [call for call in handler.calls if call[0] == 'MC1'] == [('MC1', 'Dock-A', 'page-A0')] * 2
+    assert ('A1', None, None) in handler.calls
+
+
+def test_offline_scans_pause_and_replay(make_queue):
+    offline = threading.Event()
+    offline.set()
+    handler = Recorder(failures=['A1'])
+    queue = make_queue(handler, workers=1, is_offline=offline.is_set, offline_retry=0.3)
+    item = queue.enqueue('A1', 'S1')
+    mastercode = queue.enqueue('MC1', 'S1', 'Dock-A')
+    queue.start()
+
+    # Kept without using up an attempt, and nothing else is sent while paused
+    wait_for(lambda: handler.calls and queue.offline)
+    assert queue.get(item)['status'] == 'pending'
+    assert queue.get(item)['attempts'] == 0
+    assert queue.get(mastercode)['status'] == 'pending'
+    assert len(handler.calls) == 1
+
+    offline.clear()
+    wait_for(lambda: queue.get(mastercode)['status'] == 'done')
+    assert handler.calls == [('A1', 'Dock-A', None), ('A1', 'Dock-A', None)]
+    assert queue.get(item)['attempts'] == 1
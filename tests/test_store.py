@@ -0,0 +1,31 @@
+from conftest import wait_for
+
+
+def test_replayed_route_entry_is_not_stored_twice(web_app, fake_notion, monkeypatch):
+    monkeypatch.setenv('NOTION_OFFLINE_MODE', 'true')
+    monkeypatch.setenv('NOTION_OFFLINE_RETRY_SECONDS', '0.2')
+    monkeypatch.setenv('NOTION_SCAN_ID_PROPERTY', 'Scan ID')
+    monkeypatch.setenv('NOTION_WRITE_TIMEOUT_SECONDS', '0.3')
+    web_app.context.invalidate()
+    api = fake_notion.api
+    api.add_guide_entry('MC1', 'Dock-A')
+    client = web_app.app.test_client()
+
+    # A mastercode with no entry before it, its create stored but answered too late
+    api.delay_next('pages.create', 1)
+    result = client.post('/store', json={'message': 'MC1', 'station': 'S1'}).get_json()
+    assert result['queued'], result
+    queue = web_app.get_scan_queue()
+    wait_for(lambda: queue.get(result['scan_id'])['status'] == 'done')
+
+    messages = [page['properties']['Message']['title'][0]['plain_text'] for page in api.pages.values()
+                if page['parent']['database_id'] == api.database_id]
+    assert messages == ['Dock-A']
+
+
+def test_non_object_body_gets_a_json_error(web_app):
+    client = web_app.app.test_client()
+    for body in ([], 'ITEM-A', 42):
+        response = client.post('/store', json=body)
+        assert response.status_code == 200
+        assert response.get_json() == {'success': False, 'error': 'No message provided'}
@@ -0,0 +1,29 @@
+import json
+
+
+def test_health_under_prefix_reports_that_tenant(web_app, fake_notion, tmp_path, monkeypatch):
+    tenants_path = tmp_path / 'tenants.json'
+    tenants_path.write_text(json.dumps({
+        'north': {
+            'prefix': 'north',
+            'token': 'north-token',
+            'database_id': 'fake-database',
+            'base_url': fake_notion.url,
+        },
+    }))
+    monkeypatch.setenv('NOTION_TENANTS_PATH', str(tenants_path))
+    client = web_app.app.test_client()
+    default_requests = client.get('/health').get_json()['scheduler']['requests']
+    result = client.post('/north/store', json={'message': 'ITEM-N', 'station': 'N1'}).get_json()
+    assert result['success'], result
+
+    # Only the north tenant's scheduler has sent anything
+    health = client.get('/north/health').get_json()
+    assert health['tenant'] == 'north'
+    assert health['scheduler']['requests'] > 0
+    assert 'tenants' not in health
+
+    health = client.get('/health').get_json()
+    assert health['tenant'] == 'default'
+    assert health['scheduler']['requests'] == default_requests
+    assert health['tenants']['north']['scheduler']['requests'] > 0
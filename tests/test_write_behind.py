@@ -0,0 +1,78 @@
+from conftest import wait_for
+
+
+def page_routes(api):
+    """Route of every entry in the fake main database, by message"""
+    routes = {}
+    for page in api.pages.values():
+        if page['parent']['database_id'] == api.database_id:
+            message = page['properties']['Message']['title'][0]['plain_text']
+            routes[message] = (page['properties']['Barcode']['select'] or {}).get('name')
+    return routes
+
+
+def test_retried_mastercode_update_keeps_its_entry(web_app, fake_notion, monkeypatch):
+    monkeypatch.setenv('NOTION_WRITE_BEHIND', 'true')
+    api = fake_notion.api
+    api.add_guide_entry('MC1', 'Dock-A')
+    client = web_app.app.test_client()
+    queue = web_app.get_scan_queue()
+
+    def store(message):
+        result = client.post('/store', json={'message': message, 'station': 'S1'}).get_json()
+        assert result['success'], result
+        return result['scan_id']
+
+    item_a = store('ITEM-A')
+    wait_for(lambda: queue.get(item_a)['status'] == 'done')
+
+    # The route update fails once and is retried after the station's next item was written
+    api.fail_next('pages.update')
+    mastercode = store('MC1')
+    wait_for(lambda: queue.get(mastercode)['attempts'] >= 1 and queue.get(mastercode)['status'] == 'pending')
+    item_b = store('ITEM-B')
+    wait_for(lambda: queue.get(item_b)['status'] == 'done' and queue.get(mastercode)['status'] == 'done')
+
+    assert page_routes(api) == {'ITEM-A': 'Dock-A', 'ITEM-B': None}
+
+
+def test_timed_out_create_is_not_stored_twice(web_app, fake_notion, monkeypatch):
+    monkeypatch.setenv('NOTION_WRITE_BEHIND', 'true')
+    monkeypatch.setenv('NOTION_OFFLINE_MODE', 'true')
+    monkeypatch.setenv('NOTION_OFFLINE_RETRY_SECONDS', '0.2')
+    monkeypatch.setenv('NOTION_SCAN_ID_PROPERTY', 'Scan ID')
+    monkeypatch.setenv('NOTION_WRITE_TIMEOUT_SECONDS', '0.3')
+    web_app.context.invalidate()
+    api = fake_notion.api
+    client = web_app.app.test_client()
+    queue = web_app.get_scan_queue()
+
+    # The create is stored, but answered after the app gave up on it and went offline
+    api.delay_next('pages.create', 1)
+    result = client.post('/store', json={'message': 'ITEM-A', 'station': 'S1'}).get_json()
+    wait_for(lambda: queue.get(result['scan_id'])['status'] == 'done')
+
+    assert list(page_routes(api)) == ['ITEM-A']
+    assert api.calls['pages.create'] == 1
+
+
+def test_retried_route_entry_stays_separate(web_app, fake_notion, monkeypatch):
+    monkeypatch.setenv('NOTION_WRITE_BEHIND', 'true')
+    api = fake_notion.api
+    api.add_guide_entry('MC1', 'Dock-A')
+    client = web_app.app.test_client()
+    queue = web_app.get_scan_queue()
+
+    def store(message):
+        result = client.post('/store', json={'message': message, 'station': 'S1'}).get_json()
+        assert result['success'], result
+        return result['scan_id']
+
+    # No entry before the mastercode: its route entry fails once and is retried after the next item
+    api.fail_next('pages.create')
+    mastercode = store('MC1')
+    wait_for(lambda: queue.get(mastercode)['attempts'] >= 1 and queue.get(mastercode)['status'] == 'pending')
+    item_b = store('ITEM-B')
+    wait_for(lambda: queue.get(item_b)['status'] == 'done' and queue.get(mastercode)['status'] == 'done')
+
+    assert page_routes(api) == {'Dock-A': None, 'ITEM-B': None}